@@ -6,7 +6,12 @@ Code for computing chromatic symmetric functions.
 """
 
 import itertools as it
+import multiprocessing
+import numpy as np
+from collections import defaultdict
+from math import factorial
 
+from memo import *
 from path import *
 from perm import *
 from util import *
@@ -19,28 +24,164 @@ logger.setLevel(logging.INFO)
 
 # ---------------------------------------------------------
 
-def compute_csfs(n):
+def per_path(compute):
     r"""
-    Compute the coefficients of the q-csf for everything of size n,
-    in the monomial basis.
+    Turn a function computing the q-csf of a single path into an engine,
+    which takes a list of paths and yields `(path, csf)` pairs.
     """
-    logger.info('starting size %d', n)
-    paths = list(iter_path(n))
-    perms = list(iter_blist(n))
+    def engine(paths):
+        for path in paths:
+            yield path, compute(path)
+    return engine
+
+def enumerate_csf(path):
+    r"""
+    Compute the q-csf for a single path by checking every permutation
+    colouring against every partition.
+
+    >>> enumerate_csf((0, 0, 1)) == {
+    ...     (1, 1, 1): [1, 4, 1, 0],
+    ...     (2, 1): [0, 1, 0, 0],
+    ...     (3,): [0, 0, 0, 0],
+    ...     }
+    True
+    """
+    n = len(path)
     parts = list(partitions(n))
-    for k, path in enumerate(paths):
-        logger.info('doing size %d path %d', n, k)
-        csf = {
-            part: [0]*(n*(n-1)//2+1)
-            for part in parts
-            }
-        for perm in perms:
-            degree = inversions(path, perm)
-            for part in parts:
-                if contractible(path, perm, part):
-                    csf[part][degree] += 1
-        yield path, csf
-    logger.info('done with size %d', n)
+    csf = {
+        part: [0]*(n*(n-1)//2+1)
+        for part in parts
+        }
+    for perm in iter_blist(n):
+        degree = inversions(path, perm)
+        for part in parts:
+            if contractible(path, perm, part):
+                csf[part][degree] += 1
+    return csf
+
+def transfer_csf(path):
+    r"""
+    Compute the q-csf for a single path by dynamic programming over
+    colour classes, without enumerating permutations.
+
+    A contractible colouring is built by inserting its colour classes
+    one at a time, in the order given by the partition. The state is
+    the set of positions coloured so far, and inserting a class `B`
+    on top of a state `S` adds one inversion for each box `(i, j)`
+    with `i` in `B` and `j` in `S`. States are shared between
+    partitions with a common prefix.
+
+    Polynomials in q are packed into a single integer, with one
+    coefficient every `width` bits.
+
+    >>> transfer_csf((0, 0, 1)) == enumerate_csf((0, 0, 1))
+    True
+    """
+    n = len(path)
+    degrees = n*(n-1)//2+1
+    width = max(1, factorial(n)).bit_length()
+    after = boxes_bitmasks(path)
+    classes = defaultdict(list)
+    stack = [(1 << i, i) for i in range(n)]
+    while stack:
+        mask, last = stack.pop()
+        members = [i for i in range(n) if mask >> i & 1]
+        classes[len(members)].append(
+            (mask, [after[i] for i in members]))
+        for i in range(last+1, n):
+            if not after[last] >> i & 1:
+                stack.append((mask | 1 << i, i))
+    states = {(): {0: 1}}
+    full = (1 << n) - 1
+    csf = {}
+    for part in partitions(n):
+        for k in range(len(part)):
+            if part[:k+1] in states:
+                continue
+            layer = defaultdict(int)
+            for used, poly in states[part[:k]].iteritems():
+                for mask, afters in classes[part[k]]:
+                    if mask & used:
+                        continue
+                    shift = width * sum(
+                        bin(a & used).count('1') for a in afters)
+                    layer[used | mask] += poly << shift
+            states[part[:k+1]] = layer
+        poly = states[part].get(full, 0)
+        digit = (1 << width) - 1
+        csf[part] = [
+            int((poly >> (width*d)) & digit)
+            for d in range(degrees)
+            ]
+    return csf
+
+def vectorised_csfs(paths, budget=1<<24):
+    r"""
+    Compute the q-csfs for a list of paths of the same size at once,
+    with NumPy array operations over all permutation colourings.
+
+    The permutations of size n are stored once as a table of colours and
+    a table of positions. For a chunk of paths, `inversions` becomes a
+    matrix product between the boxes under each path and the inverted
+    pairs of each permutation (done in floating point to use BLAS, which
+    is exact for such small integers). For `contractible`, each colouring gets a
+    bitmask of the consecutive colours `c, c+1` that may share a chain,
+    and the colourings are counted by path, degree and bitmask. A sum
+    over supersets of bitmasks then gives the counts for all partitions
+    at once. The chunk size is chosen so that about `budget` colourings
+    are handled at once.
+
+    >>> dict(vectorised_csfs([(0, 0, 1)]))[0, 0, 1] == enumerate_csf((0, 0, 1))
+    True
+    """
+    n = len(paths[0])
+    degrees = n*(n-1)//2+1
+    masks = 1 << max(0, n-1)
+    colours = np.array(list(iter_blist(n)), dtype=np.int8).reshape(-1, n)
+    positions = np.argsort(colours, axis=1)
+    pairs = list(it.combinations(range(n), 2))
+    lower = [i for i, j in pairs]
+    upper = [j for i, j in pairs]
+    inverted = (colours[:, lower] > colours[:, upper]).astype(np.float32)
+    ordered = [
+        positions[:, c] < positions[:, c+1]
+        for c in range(n-1)
+        ]
+    needed = {}
+    for part in partitions(n):
+        needed[part] = total = 0
+        for p in part:
+            for c in range(total, total+p-1):
+                needed[part] |= 1 << c
+            total += p
+    size = max(1, budget // len(colours))
+    for start in range(0, len(paths), size):
+        chunk = paths[start:start+size]
+        comparable = boxes_matrices(np.array(chunk).reshape(-1, n))
+        key = np.dot(comparable[:, lower, upper].astype(np.float32),
+                     inverted.T).astype(np.int32)
+        key += degrees * np.arange(len(chunk), dtype=np.int32)[:, None]
+        key *= masks
+        for c in range(n-1):
+            valid = ordered[c] & ~comparable[
+                :, positions[:, c], positions[:, c+1]]
+            key += valid.astype(np.int32) << c
+        counts = np.bincount(key.ravel(), minlength=len(chunk)*degrees*masks)
+        for c in range(n-1):
+            view = counts.reshape(-1, 2, 1 << c)
+            view[:, 0, :] += view[:, 1, :]
+        counts = counts.reshape(len(chunk), degrees, masks)
+        for k, path in enumerate(chunk):
+            yield path, {
+                part: counts[k, :, need].tolist()
+                for part, need in needed.iteritems()
+                }
+
+csf_engines = {
+    'enumerate': per_path(enumerate_csf),
+    'transfer': per_path(transfer_csf),
+    'vectorised': vectorised_csfs,
+    }
 
 # ---------------------------------------------------------
 
@@ -101,6 +242,20 @@ def contractible(path, perm, composition):
 
 # ---------------------------------------------------------
 
+def test_engines(below=6):
+    r"""
+    Test that all engines in `csf_engines` agree on small paths.
+
+    >>> test_engines()
+    """
+    for n in range(1, below):
+        paths = list(iter_path(n))
+        expected = [(path, enumerate_csf(path)) for path in paths]
+        for engine in csf_engines.itervalues():
+            assert list(engine(paths)) == expected
+
+# ---------------------------------------------------------
+
 def doctest():
     import doctest
     doctest.testmod(verbose=False)
@@ -124,12 +279,25 @@ def argparse():
     parser.add_argument(
         'n',
         type=int,
-        choices=range(1, 11),
         metavar='n',
-        help='The size of unit interval orders to consider (from 1 to 10).',
+        help='The size of unit interval orders to consider.',
+        )
+    parser.add_argument(
+        '--engine',
+        choices=sorted(csf_engines),
+        default='transfer',
+        help='How to count colourings (default: %(default)s).',
+        )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='The number of worker processes to split the paths between '
+             '(default: %(default)s).',
         )
     args = parser.parse_args()
-    return args.n
+    return args.n, args.engine, args.jobs
 
 # ---------------------------------------------------------
 
@@ -155,12 +323,54 @@ def save(path, csf):
 
 # ---------------------------------------------------------
 
+def save_csfs(n, engine='transfer', jobs=1):
+    r"""
+    Compute and save the q-csfs for everything of size n.
+
+    The paths are split into shards, which are handed out to a pool of
+    `jobs` worker processes. Each worker saves its output files as soon
+    as they are computed.
+    """
+    logger.info('starting size %d', n)
+    paths = list(enumerate(iter_path(n)))
+    if jobs == 1:
+        save_shard((n, engine, paths))
+    else:
+        size = max(1, len(paths) // (4*jobs))
+        shards = [
+            (n, engine, paths[start:start+size])
+            for start in range(0, len(paths), size)
+            ]
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for _ in pool.imap_unordered(save_shard, shards):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+    logger.info('done with size %d', n)
+
+def save_shard(shard):
+    r"""
+    Compute and save the q-csfs for a shard `(n, engine, paths)`,
+    where `paths` is a list of `(index, path)` pairs.
+    """
+    n, engine, paths = shard
+    results = csf_engines[engine]([path for k, path in paths])
+    for (k, path), (_, csf) in zip(paths, results):
+        save(path, csf)
+        logger.info('done with size %d path %d', n, k)
+    return len(paths)
+
+# ---------------------------------------------------------
+
 if __name__ == '__main__':
     doctest()
     setup_logging()
-    n = argparse()
-    for path, csf in compute_csfs(n):
-        save(path, csf)
+    n, engine, jobs = argparse()
+    save_csfs(n, engine, jobs)
+    for line in memo_stats():
+        logger.info('cache %s', line)
 
 # ---------------------------------------------------------
 
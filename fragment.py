@@ -6,8 +6,16 @@ Code for working with Dyck paths.
 """
 
 __all__ = [
+    'ROOT_BITS',
+    'coded_fragment',
+    'decode_root_product',
     'is_fragment',
+    'lperm_table',
     'lvaluated_fragment',
+    'normalize_root_product',
+    'project_root_product',
+    'root_exponents',
+    'root_index',
     'rvaluated_fragment',
     'translated_fragment',
     ]
@@ -15,65 +23,150 @@ __all__ = [
 # ---------------------------------------------------------
 
 import itertools as it
-import operator
+import numpy as np
 
 from path import *
 from perm import *
 
 # ---------------------------------------------------------
 
+ROOT_BITS = 8
+_root_mask = (1 << ROOT_BITS) - 1
+_roots = [(i, j) for j in range(64) for i in range(j)]
+
+def root_index(i, j):
+    r"""
+    Return the index of the positive root `(i, j)`, with `i < j`, in the
+    exponent vector of a coded root product. Roots are ordered by `j`
+    first, so the index does not depend on the size.
+
+    >>> [root_index(i, j) for (i, j) in [(0, 1), (0, 2), (1, 2), (0, 3)]]
+    [0, 1, 2, 3]
+    """
+    return j*(j-1)//2 + i
+
+# _shifts[a][b] is the offset of the exponent of the root {a, b}
+_shifts = [
+    [ROOT_BITS * root_index(min(a, b), max(a, b)) for b in range(64)]
+    for a in range(64)
+    ]
+
+def root_exponents(code):
+    r"""
+    Yield the triples `(i, j, e)` such that the root `(i, j)` has the
+    nonzero exponent `e` in the coded root product `code`.
+
+    A coded root product is an integer packing the exponent of root
+    number `root_index(i, j)` in the `ROOT_BITS` bits starting at
+    ``root_index(i, j) * ROOT_BITS``.
+
+    >>> list(root_exponents(0x1000002))
+    [(0, 1, 2), (0, 3, 1)]
+    """
+    r = 0
+    while code:
+        e = code & _root_mask
+        if e:
+            i, j = _roots[r]
+            yield i, j, e
+        code >>= ROOT_BITS
+        r += 1
+
 def normalize_root_product(roots):
     r"""
-    Return a `sign, roots` pair where `sign` is ``\pm 1`` or 0
-    and `roots` is a sorted tuple of roots `(i, j)` with `i < j`.
+    Return a `sign, code` pair where `sign` is ``\pm 1`` or 0
+    and `code` is the coded root product (see `root_exponents`)
+    of the given roots `(i, j)`, oriented so that `i < j`.
 
     >>> normalize_root_product([])
-    (1, ())
+    (1, 0)
     >>> normalize_root_product([(0, 1), (0, 2), (1, 2)])
-    (1, ((0, 1), (0, 2), (1, 2)))
+    (1, 65793)
     >>> normalize_root_product([(0, 1), (0, 2), (2, 1)])
-    (-1, ((0, 1), (0, 2), (1, 2)))
+    (-1, 65793)
     >>> normalize_root_product([(0, 1), (2, 0), (2, 1)])
-    (1, ((0, 1), (0, 2), (1, 2)))
+    (1, 65793)
     >>> normalize_root_product([(0, 1), (1, 2), (0, 2)])
-    (1, ((0, 1), (0, 2), (1, 2)))
+    (1, 65793)
     >>> normalize_root_product([(0, 1), (0, 0), (1, 2)])
-    (0, ())
+    (0, 0)
     """
     sign = 1
-    result = []
+    code = 0
     for (i, j) in roots:
-        if i < j:
-            result.append((i, j))
-        elif i > j:
-            result.append((j, i))
+        if i > j:
+            i, j = j, i
             sign = -sign
-        else:
-            return 0, ()
-    result.sort()
-    return sign, tuple(result)
+        elif i == j:
+            return 0, 0
+        code += 1 << (ROOT_BITS * root_index(i, j))
+    assert all(e <= _root_mask >> 1 for _, _, e in root_exponents(code))
+    return sign, code
+
+def decode_root_product(code):
+    r"""
+    Return the sorted tuple of roots `(i, j)` of a coded root product.
+
+    >>> sign, code = normalize_root_product([(1, 2), (0, 1), (0, 1)])
+    >>> decode_root_product(code)
+    ((0, 1), (0, 1), (1, 2))
+    """
+    return tuple(sorted(
+        (i, j) for i, j, e in root_exponents(code) for _ in range(e)))
+
+def coded_fragment(frag):
+    r"""
+    Return the vector fragment `frag`, given as a dict of
+    (blist->list of roots), with its coordinates replaced by their
+    normalized `sign, code` pairs, as used by the other functions here.
+
+    >>> coded_fragment({(1, 0): ((1, 0),)})
+    {(1, 0): (-1, 1)}
+    """
+    return {
+        bl: normalize_root_product(roots)
+        for bl, roots in frag.iteritems()
+        }
 
-def project_root_product(roots, fro, to):
+def project_root_product(root_product, fro, to):
     r"""
-    Return a `sign, roots` pair `sign` is ``\pm 1`` or 0
-    and `roots` is obtained by replacing every instance
-    of `fro` by `to` in the given roots (and normalizing).
+    Return the `sign, code` pair obtained by replacing every
+    instance of `fro` by `to` in the roots of the normalized
+    root product `root_product` (and normalizing).
 
-    >>> project_root_product([(0, 1)], fro=1, to=3)
+    >>> def project(roots, fro, to):
+    ...     sign, code = project_root_product(
+    ...         normalize_root_product(roots), fro, to)
+    ...     return sign, decode_root_product(code)
+    >>> project([(0, 1)], fro=1, to=3)
     (1, ((0, 3),))
-    >>> project_root_product([(0, 1)], fro=2, to=3)
+    >>> project([(0, 1)], fro=2, to=3)
     (1, ((0, 1),))
-    >>> project_root_product([(0, 1)], fro=3, to=1)
+    >>> project([(0, 1)], fro=3, to=1)
     (1, ((0, 1),))
-    >>> project_root_product([(0, 1)], fro=0, to=3)
+    >>> project([(0, 1)], fro=0, to=3)
     (-1, ((1, 3),))
-    >>> project_root_product([(0, 1)], fro=0, to=1)
+    >>> project([(0, 1)], fro=0, to=1)
     (0, ())
     """
-    return normalize_root_product(
-        (i if i != fro else to,
-         j if j != fro else to)
-        for (i, j) in roots)
+    sign, code = root_product
+    if not sign:
+        return 0, 0
+    result = code
+    top = _roots[(code.bit_length() - 1) // ROOT_BITS][1] if code else 0
+    fro_shifts, to_shifts = _shifts[fro], _shifts[to]
+    for k in range(max(top, fro) + 1):
+        if k == fro:
+            continue
+        e = (code >> fro_shifts[k]) & _root_mask
+        if not e:
+            continue
+        if k == to:
+            return 0, 0
+        result += (e << to_shifts[k]) - (e << fro_shifts[k])
+        if (fro < k) != (to < k) and e & 1:
+            sign = -sign
+    return sign, result
 
 # ---------------------------------------------------------
 
@@ -81,7 +174,9 @@ def is_fragment(frag, path):
     r"""
     Check whether `frag` is a valid vector fragment.
 
-    A vector fragment is given as a dict of (blist->root_product).
+    A vector fragment is given as a dict of (blist->root_product),
+    where root products are normalized `sign, code` pairs
+    (see `coded_fragment`).
     The coefficient for a missing blist is assumed to be zero or don't-care.
     The fragment is valid if the coefficients for the given
     blists satisfy the divisibility conditions associated with `path`
@@ -98,7 +193,7 @@ def is_fragment(frag, path):
                 tmp[i], tmp[j] = tmp[j], tmp[i]
                 tmp = tuple(tmp)
                 root_prod_above = frag[bl]
-                root_prod_below = frag.get(tmp, ((0, 0),))
+                root_prod_below = frag.get(tmp, (0, 0))
                 if (project_root_product(root_prod_above, fro=bl[i], to=bl[j]) !=
                     project_root_product(root_prod_below, fro=bl[i], to=bl[j])):
                         return False
@@ -158,6 +253,24 @@ def translated_fragment(lperm, frag):
         result[tmp] = frag[bl]
     return result
 
+def lperm_table(lperms, blists=None):
+    r"""
+    Return the array whose entry `[t, r]` is the rank of
+    ``prod_lperm(lperms[t], bl)``, where `bl` is the blist of rank `r`.
+
+    The optional argument `blists` is the array of all blists of the
+    same size, in rank order.
+
+    >>> lperm_table([(0, 1, 2), (1, 2, 0)])
+    array([[0, 1, 2, 3, 4, 5],
+           [4, 5, 0, 1, 2, 3]])
+    >>> test_lperm_table()
+    """
+    lperms = np.asarray(lperms)
+    if blists is None:
+        blists = blists_from_bfacts(bfacts_from_ranks(lperms.shape[1]))
+    return ranks_from_blists(blists[:, lperms]).T
+
 def lvaluated_fragment(frag):
     r"""
     Return the result of evaluating all coordinates of `frag` at ``L_i = i``.
@@ -170,7 +283,7 @@ def lvaluated_fragment(frag):
     ...     (2, 0, 1): ((0, 1), (0, 2)),
     ...     (2, 1, 0): ((0, 1), (0, 2)),
     ...     }
-    >>> lvaluated_fragment(frag) == {
+    >>> lvaluated_fragment(coded_fragment(frag)) == {
     ...     (0, 1, 2): 2,
     ...     (1, 0, 2): -1,
     ...     (0, 2, 1): 2,
@@ -181,12 +294,14 @@ def lvaluated_fragment(frag):
     True
     """
     result = {}
-    for bl, coeff in frag.iteritems():
-        result[bl] = reduce(
-            operator.mul,
-            [bl.index(i)-bl.index(j) for (i, j) in coeff],
-            1,
-            )
+    for bl, (sign, code) in frag.iteritems():
+        where = [0] * len(bl)
+        for k, i in enumerate(bl):
+            where[i] = k
+        value = sign
+        for i, j, e in root_exponents(code):
+            value *= (where[i] - where[j]) ** e
+        result[bl] = value
     return result
 
 def rvaluated_fragment(frag):
@@ -201,7 +316,7 @@ def rvaluated_fragment(frag):
     ...     (2, 0, 1): ((0, 2),),
     ...     (2, 1, 0): ((0, 1), (0, 2), (0, 2), (0, 2), (0, 2)),
     ...     }
-    >>> rvaluated_fragment(frag) == {
+    >>> rvaluated_fragment(coded_fragment(frag)) == {
     ...     (0, 1, 2): 1,
     ...     (1, 0, 2): 2,
     ...     (0, 2, 1): -8,
@@ -212,12 +327,11 @@ def rvaluated_fragment(frag):
     True
     """
     result = {}
-    for bl, coeff in frag.iteritems():
-        result[bl] = reduce(
-            operator.mul,
-            [i-j for (i, j) in coeff],
-            1,
-            )
+    for bl, (sign, code) in frag.iteritems():
+        value = sign
+        for i, j, e in root_exponents(code):
+            value *= (i - j) ** e
+        result[bl] = value
     return result
 
 # ---------------------------------------------------------
@@ -292,6 +406,7 @@ def test_is_fragment():
             (2, 1, 0): ((0, 0),),
         },
         ]
+    frags = map(coded_fragment, frags)
     assert ([is_fragment(frag, path) for frag in frags for path in paths] ==
         [
         1, 1, 1, 1, 1, #0
@@ -309,6 +424,20 @@ def test_is_fragment():
         0, 0, 1, 0, 1, #12
         ])
 
+def test_lperm_table(below=5):
+    r"""
+    Test that `lperm_table` agrees with `prod_lperm`.
+
+    >>> test_lperm_table()
+    """
+    for n in range(1, below):
+        lperms = list(iter_blist(n))
+        table = lperm_table(lperms)
+        for t, lp in enumerate(lperms):
+            for r in range(len(lperms)):
+                moved = prod_lperm(lp, blist_from_rank(r, n))
+                assert table[t, r] == rank_from_blist(moved)
+
 def test_associativity():
     r"""
     Test that `prod_lperm` and `translated_fragment` are associative
@@ -5,13 +5,23 @@ r"""
 Code for computing characters of Hessenberg varieties.
 """
 
+import errno
 import itertools as it
+import json
+import multiprocessing
 import numpy as np
-from collections import defaultdict
+import os
+import shutil
+import sys
+import tempfile
+from collections import defaultdict, namedtuple
+from math import factorial
 
 from fragment import *
+from memo import *
 from path import *
 from perm import *
+from store import *
 from util import *
 
 # ---------------------------------------------------------
@@ -19,6 +29,7 @@ from util import *
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
+logger.addHandler(logging.NullHandler())
 
 # ---------------------------------------------------------
 
@@ -48,212 +59,1571 @@ def translators(n):
 
 # ---------------------------------------------------------
 
+def _blists_compute(n):
+    r"""
+    Return the array of blists of length `n` in rank order.
+    """
+    return blists_from_bfacts(bfacts_from_ranks(n))
+
+# Not bounded: `prefix_roots` goes through all the sizes up to that of
+# the path, and their blists take little more room than the largest.
+all_blists = memoize('all_blists')(_blists_compute)
+
+# The functions from `rpspec` to `flowup_fragment` build the flowup
+# fragments one bfact at a time. They are kept as the reference that
+# the tests check `prefix_roots` and `path_table` against, and are not
+# used to compute the outputs.
+
 def rpspec(bfact, path):
     r"""
     Do some voodoo on a bijection and a path to get a root product spec.
+
+    Return a pair of int8 arrays `(mobile, fixed)`. A row `(jj, i)` of
+    `mobile` stands for the root from the entry at position `jj` of the
+    blist made of `0, ..., i` to `i`, and a row `(j, i)` of `fixed` is
+    the root `(j, i)` itself.
+
+    The blist made of `0, ..., i` is the final blist with the larger
+    entries left out, so each step is read off the final blist instead
+    of being built by insertion.
+
+    >>> rpspec((0, 0, 1, 3), (0, 0, 0, 1))
+    (array([[2, 2]], dtype=int8), array([[2, 3],
+           [1, 3]], dtype=int8))
     """
-    mobile, fixed = [], []
-    blist = []
     n = len(bfact)
     assert is_bfact(bfact)
     assert is_path(path)
     assert n == len(path)
+    blist = all_blists(n)[rank_from_bfact(bfact)].tolist()
+    where = np.argsort(blist)
+    mobile, fixed = [], []
     for i in range(n):
-        j = len(blist) - bfact[i]
-        blist.insert(j, i)
+        jj = i - bfact[i]
         crossed = False
-        for jj in range(j+1, len(blist)):
-            if blist[jj] < path[i]:
+        for v in blist[where[i]+1:]:
+            if v > i:
+                continue
+            jj += 1
+            if v < path[i]:
                 crossed = True
-            elif blist[jj] < i:
-                if crossed:
-                    fixed.append((blist[jj], i, 'f'))
-                else:
-                    mobile.append((jj, i, 'm'))
-    return mobile, fixed
+            elif crossed:
+                fixed.append((v, i))
+            else:
+                mobile.append((jj, i))
+    return (np.array(mobile, dtype=np.int8).reshape(-1, 2),
+            np.array(fixed, dtype=np.int8).reshape(-1, 2))
 
-def rp(bfact, spec):
+def rp_arrays(blists, spec):
     r"""
-    Do some more voodoo to transform a spec into an actual root product.
+    Do some more voodoo to transform a spec into actual root products,
+    for all the blists in the rows of the array `blists` at once.
+
+    Return a pair of int8 arrays `(lower, upper)`, so that the root
+    product at row `r` of `blists` is made of the roots
+    `(lower[r, d], upper[r, d])`.
+
+    >>> spec = rpspec((0, 0, 1, 3), (0, 0, 0, 1))
+    >>> rp_arrays(np.array([[3, 0, 2, 1], [3, 1, 2, 0]]), spec)
+    (array([[2, 1, 1],
+           [2, 1, 0]], dtype=int8), array([[3, 3, 2],
+           [3, 3, 2]], dtype=int8))
     """
     mobile, fixed = spec
-    result = []
-    for (j, i, f) in fixed:
-        assert f == 'f'
-        result.append((j, i))
-    blist = []
-    for i in range(len(bfact)):
-        j = len(blist) - bfact[i]
-        blist.insert(j, i)
-        for (jj, ii, m) in mobile:
-            assert m == 'm'
-            if ii == i:
-                result.append((blist[jj], i))
-    return result
+    rows = len(blists)
+    # entry number jj among the entries at most i of each blist
+    kept = blists[:, None, :] <= mobile[None, :, 1, None]
+    counts = np.cumsum(kept, axis=-1)
+    chosen = kept & (counts == mobile[None, :, 0, None] + 1)
+    picked = blists[np.arange(rows)[:, None], chosen.argmax(axis=-1)]
+    lower = np.hstack([
+        np.broadcast_to(fixed[:, 0], (rows, len(fixed))), picked])
+    upper = np.hstack([
+        np.broadcast_to(fixed[:, 1], (rows, len(fixed))),
+        np.broadcast_to(mobile[:, 1], (rows, len(mobile)))])
+    return lower.astype(np.int8), upper.astype(np.int8)
+
+Flowup = namedtuple('Flowup', 'ranks lower upper')
 
-_flowup_cache = {}
 def flowup(bfact, path):
-    try:
-        return _flowup_cache[bfact, path]
-    except KeyError:
-        result = _flowup_compute(bfact, path)
-        _flowup_cache[bfact, path] = result
-        return result
-def _flowup_compute(bfact, path):
     r"""
-    Return a fragment of a flowup basis vector.
+    Return a fragment of a flowup basis vector, as a `Flowup` of arrays:
+    the sorted ranks of its coordinates, and the roots of the root
+    product at each of them (see `rp_arrays`).
+
+    >>> flowup((0, 1, 0, 1), (0, 0, 1, 1))
+    Flowup(ranks=array([13, 14, 17, 18]), lower=array([[0, 2],
+           [0, 2],
+           [0, 0],
+           [0, 0]], dtype=int8), upper=array([[1, 3],
+           [1, 3],
+           [1, 3],
+           [1, 3]], dtype=int8))
     """
     spec = rpspec(bfact, path)
-    result = {}
-    projections = [
-        ((i, i+1) if i < k else (i,))
-        for k, i in enumerate(bfact)
-        ]
-    coords = list(it.product(*projections))
-    assert all(is_bfact(c) for c in coords)
-    for c in coords:
-        result[blist_from_bfact(c)] = rp(c, spec)
+    free = [k for k, i in enumerate(bfact) if i < k]
+    offsets = np.zeros((1 << len(free), len(bfact)), dtype=np.int8)
+    for b, k in enumerate(reversed(free)):
+        offsets[:, k] = (np.arange(len(offsets)) >> b) & 1
+    ranks = ranks_from_bfacts(np.array(bfact, dtype=np.int8) + offsets)
+    lower, upper = rp_arrays(all_blists(len(bfact))[ranks], spec)
+    return Flowup(ranks, lower, upper)
+
+def flowup_fragment(bfact, path):
+    r"""
+    Return the flowup fragment of `flowup(bfact, path)` as a dict from
+    blists to coded root products, as used in `fragment`.
+
+    >>> frag = flowup_fragment((0, 0, 1, 3), (0, 0, 0, 1))
+    >>> bl, (sign, code) = sorted(frag.items())[0]
+    >>> bl, sign, decode_root_product(code)
+    ((3, 0, 2, 1), 1, ((1, 2), (1, 3), (2, 3)))
+    >>> test_flowup()
+    """
+    ranks, lower, upper = flowup(bfact, path)
+    n = len(bfact)
+    return {
+        blist_from_rank(int(rank), n):
+            normalize_root_product(zip(lows.tolist(), ups.tolist()))
+        for rank, lows, ups in zip(ranks, lower, upper)
+        }
+
+PrefixRoots = namedtuple('PrefixRoots', 'mobile fixed')
+
+def _prefix_roots_compute(prefix):
+    r"""
+    Return the roots of the specs from `rpspec` for the first steps of
+    a path starting with `prefix`, for all bfacts of the same length
+    `k` as `prefix`, as a `PrefixRoots` of boolean arrays indexed by
+    bfact rank: `mobile[r, s]` is set if the spec has the mobile root
+    `(jj, i)` with ``s = i*(i+1)//2 + jj``, and `fixed[r, s]` is set if
+    it has the fixed root `(v, i)` with ``s = root_index(v, i)``.
+
+    Step `i` of `rpspec` only reads `path[i]` and the blist made of
+    ``0, ..., i``, which only depends on the first ``i+1`` entries of
+    the bfact. So these arrays are those for ``prefix[:-1]``, with each
+    row repeated for the `k` ways to extend the bfact, followed by the
+    last step, which reads the last digit of the bfact of rank `r`,
+    that is ``r % k``. The Dyck paths sharing a prefix, including shorter ones,
+    share the cached arrays for it; see `iter_path_tree` and
+    `forget_prefixes`.
+
+    >>> roots = prefix_roots((0, 0, 0, 1))
+    >>> r = rank_from_bfact((0, 0, 1, 3))
+    >>> np.nonzero(roots.mobile[r])[0], np.nonzero(roots.fixed[r])[0]
+    (array([5]), array([4, 5]))
+    >>> test_prefix_roots()
+    """
+    k = len(prefix)
+    if not k:
+        return PrefixRoots(np.zeros((1, 0), bool), np.zeros((1, 0), bool))
+    parent = prefix_roots(prefix[:-1])
+    i = k - 1
+    blists = all_blists(k)
+    last = np.arange(len(blists))[:, None] % k
+    spots = np.arange(k) > (i - last)
+    less = blists < prefix[-1]
+    crossed = np.cumsum(spots & less, axis=1) > 0
+    mobile = spots & ~less & ~crossed
+    rows, cols = np.nonzero(spots & ~less & crossed)
+    fixed = np.zeros((len(blists), i), dtype=bool)
+    fixed[rows, blists[rows, cols]] = True
+    return PrefixRoots(
+        np.hstack([np.repeat(parent.mobile, k, axis=0), mobile]),
+        np.hstack([np.repeat(parent.fixed, k, axis=0), fixed]))
+
+prefix_roots = memoize(
+    'prefix_roots', maxbytes=1 << 29,
+    )(_prefix_roots_compute)
+
+def forget_prefixes(path):
+    r"""
+    Drop the cached `prefix_roots` for the prefixes which are not
+    prefixes of `path`. When the paths are taken in the order of
+    `iter_path_tree`, these are never used again.
+    """
+    prefix_roots.discard(lambda key: key[0] != path[:len(key[0])])
+
+def _staircase_compute(n):
+    r"""
+    Return the int8 array whose row `r` is made of the blists made of
+    ``0, ..., i`` for each `i`, taken from the blist of rank `r`, so
+    that entry ``i*(i+1)//2 + jj`` is the lower end of the mobile root
+    `(jj, i)` at this blist (see `rp_arrays`).
+
+    Since the bfact of the blist made of ``0, ..., i`` is the prefix
+    of length ``i+1`` of the bfact, these are rows of `all_blists`.
+
+    >>> staircase(3)[3]
+    array([0, 1, 0, 1, 0, 2], dtype=int8)
+    """
+    ranks = np.arange(factorial(n))
+    return np.hstack([
+        all_blists(i + 1)[ranks // (factorial(n) // factorial(i + 1))]
+        for i in range(n)]).astype(np.int8)
+
+staircase = memoize('staircase', maxsize=2)(_staircase_compute)
+
+# ---------------------------------------------------------
+
+def offset_ranks(n, shift, ranks=None):
+    r"""
+    Return the array whose entry `[r, o]` is the rank of the bfact
+    ``bf + offset - shift``, or -1 if this is not a valid bfact.
+    Here `bf` is the bfact of rank `r` (or of rank `ranks[r]`, if these
+    are given), and `offset` is the offset number `o` in the flattened
+    cube (see `offset_cube`).
+
+    The array is computed one digit at a time for all bfacts and
+    offsets at once, using that ranks are linear in the digits.
+
+    >>> offset_ranks(3, (0, 1, 1))[5]
+    array([1, 2, 4, 5])
+    """
+    bfs = bfacts_from_ranks(n, ranks).astype(int)
+    if ranks is None:
+        ranks = np.arange(len(bfs))
+    offsets = np.array(
+        list(it.product(*([(0,)] + [(0, 1)]*(n-1)))), dtype=int)
+    weights = ranks_from_bfacts(np.eye(n, dtype=int))
+    result = np.repeat(np.asarray(ranks)[:, None], len(offsets), axis=1)
+    valid = np.ones(result.shape, dtype=bool)
+    for i in range(n):
+        steps = offsets[:, i] - shift[i]
+        digits = bfs[:, i, None] + steps
+        valid &= (digits >= 0) & (digits <= i)
+        result += steps * weights[i]
+    result[~valid] = -1
     return result
 
+def size_shift(n, name):
+    r"""
+    Return the shift of `offset_ranks` for the cubes of offsets `name`
+    (either 'above' or 'below') each bfact of size `n`.
+
+    >>> size_shift(3, 'above'), size_shift(3, 'below')
+    ((0, 0, 0), (0, 1, 1))
+    """
+    return {'above': (0,)*n, 'below': (0,) + (1,)*(n-1)}[name]
+
 # ---------------------------------------------------------
 
-_indices_above_cache = {}
-def indices_above(bfact):
-    try:
-        return _indices_above_cache[bfact]
-    except KeyError:
-        result = _indices_above_compute(bfact)
-        _indices_above_cache[bfact] = result
-        return result
-def _indices_above_compute(bfact):
-    result = {}
-    assert is_bfact(bfact)
-    n = len(bfact)
-    for offset in it.product(*([(0,)] + [(0, 1)]*(n-1))):
-        ofact = tuple(b+o for b, o in zip(bfact, offset))
-        if is_bfact(ofact):
-            olist = blist_from_bfact(ofact)
-            result[offset] = olist
+def offset_cube(n):
+    r"""
+    Return the elimination steps on a flattened cube of offsets.
+
+    Offsets are flattened in the order of `it.product`, so that offset
+    `o` of the cube is the bitmask of its nonzero entries. Step `o`
+    subtracts entry `s` of a basis vector from entry `s | o` of a work
+    array, for every `s` disjoint from `o`, and is returned as a pair
+    of index arrays `(sources, targets)`.
+
+    >>> [(list(s), list(t)) for s, t in offset_cube(2)]
+    [([0, 1], [0, 1]), ([0], [1])]
+    """
+    size = 1 << max(0, n-1)
+    result = []
+    for o in range(size):
+        sources = np.array([s for s in range(size) if s & o == 0])
+        result.append((sources, sources | o))
     return result
 
-_indices_below_cache = {}
-def indices_below(bfact):
-    try:
-        return _indices_below_cache[bfact]
-    except KeyError:
-        result = _indices_below_compute(bfact)
-        _indices_below_cache[bfact] = result
+Cubes = namedtuple('Cubes', 'values rows starts free fixed bits')
+
+def sparse_cubes(dense):
+    r"""
+    Return the entries of the 2-D array `dense` which are not -1, as
+    `Cubes` of offsets.
+
+    Row `k` only has the offsets `o` for which ``o & ~free[k]`` is
+    `fixed[k]`, and these are stored in increasing order from
+    `values[starts[k]]` on, so that offset `o` is at position
+    ``starts[k] + compressed_offsets(bits)[free[k], o]``, where the
+    offsets are below ``2**bits``. The row of each value is `rows`.
+    Arrays in the same layout (such as the values of
+    basis vectors or work arrays) are stored as copies of the `Cubes`
+    with other `values`.
+
+    >>> cubes = sparse_cubes(offset_ranks(3, size_shift(3, 'below')))
+    >>> cubes.values
+    array([0, 0, 1, 1, 2, 0, 3, 0, 1, 3, 4, 1, 2, 4, 5])
+    >>> cubes.starts
+    array([ 0,  1,  3,  5,  7, 11])
+    >>> cubes.free, cubes.fixed
+    (array([0, 1, 1, 2, 3, 3]), array([3, 2, 2, 1, 0, 0]))
+    """
+    valid = dense >= 0
+    offsets = np.arange(dense.shape[1])
+    rows = np.nonzero(valid)[0]
+    counts = valid.sum(axis=1)
+    assert counts.all()
+    starts = np.cumsum(counts) - counts
+    fixed = np.bitwise_and.reduce(np.where(valid, offsets, -1), axis=1)
+    free = np.bitwise_or.reduce(np.where(valid, offsets, 0), axis=1) ^ fixed
+    assert (valid == ((offsets & ~free[:, None]) == fixed[:, None])).all()
+    bits = max(1, (dense.shape[1] - 1).bit_length())
+    return Cubes(dense[valid], rows, starts, free, fixed, bits)
+
+def _compressed_compute(bits):
+    r"""
+    Return the array whose entry `[m, o]` is the number made of the
+    bits of `o` at the positions of the bits of `m`, for all `m` and
+    `o` below ``2**bits``.
+
+    >>> compressed_offsets(3)[5]
+    array([0, 1, 0, 1, 2, 3, 2, 3])
+    """
+    masks, offsets = np.indices((1 << bits, 1 << bits))
+    result = np.zeros(masks.shape, dtype=int)
+    shift = np.zeros(masks.shape, dtype=int)
+    for bit in range(bits):
+        used = (masks >> bit) & 1
+        result |= ((offsets >> bit) & used) << shift
+        shift += used
+    return result
+
+compressed_offsets = memoize(
+    'compressed_offsets', maxsize=4)(_compressed_compute)
+
+def offset_cubes(n, shift, block=1 << 14, outline=False):
+    r"""
+    Return the `sparse_cubes` of `offset_ranks(n, shift)`, with int32
+    values and rows, computed `block` bfacts at a time by `offset_block`
+    so that the dense array is never built.
+
+    If `outline` is set, only the layout of the cubes is kept: their
+    `values` and `rows` are None, and the rows are made again when they
+    are needed (see `size_block`).
+
+    >>> cubes = offset_cubes(4, (0, 1, 1, 1), 5)
+    >>> dense = sparse_cubes(offset_ranks(4, size_shift(4, 'below')))
+    >>> all(np.array_equal(a, b) for a, b in zip(cubes, dense))
+    True
+    >>> outline = offset_cubes(4, (0, 1, 1, 1), 5, True)
+    >>> outline.values, (outline.starts == dense.starts).all()
+    (None, True)
+    """
+    parts = []
+    total = factorial(n)
+    for start in range(0, total, block):
+        part = offset_block(n, shift, start, min(start + block, total))
+        if outline:
+            part = part._replace(values=None, rows=None)
+        parts.append(part)
+    sizes = np.cumsum([0] + [cubes_size(part) for part in parts])
+    return Cubes(
+        None if outline else np.concatenate([part.values for part in parts]),
+        None if outline else np.concatenate([part.rows for part in parts]),
+        np.concatenate([
+            part.starts + size for size, part in zip(sizes, parts)]),
+        np.concatenate([part.free for part in parts]),
+        np.concatenate([part.fixed for part in parts]),
+        parts[0].bits)
+
+def offset_block(n, shift, start, stop):
+    r"""
+    Return the same `Cubes` as
+    ``cubes_block(offset_cubes(n, shift), start, stop)``, computed
+    directly with `offset_ranks`.
+
+    >>> block = offset_block(3, (0, 1, 1), 2, 4)
+    >>> block.values, block.rows, block.starts
+    (array([1, 2, 0, 3], dtype=int32), array([2, 2, 3, 3], dtype=int32), array([0, 2]))
+    """
+    part = sparse_cubes(offset_ranks(n, shift, np.arange(start, stop)))
+    return part._replace(values=part.values.astype(np.int32),
+                         rows=(part.rows + start).astype(np.int32))
+
+def row_sizes(cubes, rows):
+    r"""
+    Return the numbers of values in the given `rows` of `cubes`.
+
+    >>> cubes = sparse_cubes(offset_ranks(3, size_shift(3, 'below')))
+    >>> row_sizes(cubes, np.arange(6))
+    array([1, 2, 2, 2, 4, 4])
+    """
+    return compressed_offsets(cubes.bits)[cubes.free[rows], -1] + 1
+
+def cubes_size(cubes):
+    r"""
+    Return the number of values of `cubes`, which may be an outline
+    (see `offset_cubes`).
+    """
+    return int(cubes.starts[-1] + row_sizes(cubes, -1))
+
+def cubes_rows(cubes, rows):
+    r"""
+    Return the `Cubes` made of the given `rows` of `cubes`, in this
+    order, without their `rows` array.
+
+    >>> cubes = sparse_cubes(offset_ranks(3, size_shift(3, 'below')))
+    >>> part = cubes_rows(cubes, np.array([4, 1]))
+    >>> part.values, part.starts
+    (array([0, 1, 3, 4, 0, 1]), array([0, 4]))
+    """
+    sizes = row_sizes(cubes, rows)
+    starts = np.cumsum(sizes) - sizes
+    where = np.repeat(cubes.starts[rows] - starts, sizes) + np.arange(
+        sizes.sum())
+    return Cubes(cubes.values[where], None, starts, cubes.free[rows],
+                 cubes.fixed[rows], cubes.bits)
+
+def cubes_block(cubes, start, stop):
+    r"""
+    Return the rows `start` to `stop` of `cubes` as `Cubes` of their
+    own, except that `rows` still holds the numbers of the rows in the
+    whole `cubes`.
+
+    >>> cubes = sparse_cubes(offset_ranks(3, size_shift(3, 'below')))
+    >>> block = cubes_block(cubes, 2, 4)
+    >>> block.values, block.rows, block.starts
+    (array([1, 2, 0, 3]), array([2, 2, 3, 3]), array([0, 2]))
+    """
+    first = cubes.starts[start]
+    last = cubes.starts[stop] if stop < len(cubes.starts) else len(
+        cubes.values)
+    return Cubes(
+        cubes.values[first:last], cubes.rows[first:last],
+        cubes.starts[start:stop] - first, cubes.free[start:stop],
+        cubes.fixed[start:stop], cubes.bits)
+
+def size_block(tables, name, start, stop):
+    r"""
+    Return the rows `start` to `stop` of the cubes `name` (either
+    'above' or 'below') of the `SizeTables` `tables`, as `cubes_block`
+    does. If these cubes are an outline, the rows are made by
+    `offset_block`.
+    """
+    cubes = getattr(tables, name)
+    if cubes.values is not None:
+        return cubes_block(cubes, start, stop)
+    n = tables.blists.shape[1]
+    return offset_block(n, size_shift(n, name), start, stop)
+
+def size_blocks(tables, name, block=None):
+    r"""
+    Iterate over the pairs `(start, size_block(tables, name, start,
+    stop))` which cover all rows, `block` rows at a time (or all at
+    once if `block` is None).
+
+    >>> tables = size_tables(3, False)
+    >>> [(start, len(part.starts))
+    ...  for start, part in size_blocks(tables, 'below', 4)]
+    [(0, 4), (4, 2)]
+    """
+    rows = len(tables.blists)
+    step = rows if block is None else block
+    for start in range(0, rows, step):
+        yield start, size_block(
+            tables, name, start, min(start + step, rows))
+
+def cube_positions(cubes, rows, offsets):
+    r"""
+    Return the positions in `cubes.values` of the `offsets` of the
+    `rows`, which are broadcast together, and a boolean array telling
+    which of them are present.
+
+    >>> cubes = sparse_cubes(offset_ranks(3, size_shift(3, 'below')))
+    >>> cube_positions(cubes, np.array([0, 4]), 3)
+    (array([ 0, 10]), array([ True,  True]))
+    >>> cube_positions(cubes, 5, np.arange(4))[1]
+    array([ True,  True,  True,  True])
+    """
+    free, fixed = cubes.free[rows], cubes.fixed[rows]
+    present = (offsets & ~free) == fixed
+    where = cubes.starts[rows] + compressed_offsets(cubes.bits)[free, offsets]
+    return where, present
+
+native_limit = 1 << 61
+
+def native_array(array):
+    r"""
+    Convert an object array of integers to int64, raising
+    `OverflowError` if some entry is not smaller than `native_limit`
+    in absolute value.
+
+    >>> native_array(np.array([1, -2], dtype=object))
+    array([ 1, -2])
+    >>> native_array(np.array([1, 1 << 61], dtype=object))
+    Traceback (most recent call last):
+    ...
+    OverflowError: entries too large for int64
+    """
+    result = array.astype(np.int64)
+    if not fits_native(result):
+        raise OverflowError('entries too large for int64')
+    return result
+
+def fits_native(array):
+    return ((array > -native_limit) & (array < native_limit)).all()
+
+def eliminate(work_array, basis, below, cube, modulus=None):
+    r"""
+    Solve the triangular systems of all bfacts at once.
+
+    Row `k` of the `Cubes` `work_array` holds coordinates below the
+    bfact of rank `k`, and `below` (in the same layout) holds their
+    ranks. Row `r` of the `Cubes` `basis` holds the basis vector of
+    the bfact of rank `r`. The offsets are eliminated in increasing
+    order, each step being done for all rows at once, and the quotients
+    of the last step are returned. Coordinates which are missing from
+    the cubes are never used.
+
+    The divisions are checked to be exact. The values may either be
+    Python integers (dtype object) or int64, in which case every step
+    checks that they stay below `native_limit` (estimating the products
+    in floating point) and raises `OverflowError` otherwise.
+
+    If `modulus` is not None, the values are instead int64 residues
+    modulo this prime, and the leading coordinates are inverted modulo
+    it. The divisions cannot be checked to be exact then; instead the
+    results are checked at an extra prime (see `compute_hess_modular`).
+
+    >>> cube = offset_cube(2)
+    >>> below = sparse_cubes(np.array([[-1, 0], [0, 1]]))
+    >>> basis = sparse_cubes(np.array([[2, 0], [3, -1]], dtype=object))
+    >>> work_array = below._replace(values=np.array([4, 2, 9], dtype=object))
+    >>> eliminate(work_array, basis, below, cube)
+    array([2, 3], dtype=object)
+    >>> work_array = below._replace(values=np.array([4, 2, 9]))
+    >>> eliminate(work_array, basis._replace(values=np.array([2, 0, 3])),
+    ...           below, cube, 11)
+    array([2, 3])
+    >>> basis = basis._replace(values=np.array([2, 1 << 40, 3]))
+    >>> work_array = below._replace(values=np.array([0, 1 << 30, 0]))
+    >>> eliminate(work_array, basis, below, cube)
+    Traceback (most recent call last):
+    ...
+    OverflowError: entries too large for int64
+    """
+    values = work_array.values
+    native = values.dtype != object and modulus is None
+    if modulus is not None:
+        inverses = inverses_modulo(basis.values[basis.starts], modulus)
+    everything = np.arange(len(work_array.starts))
+    quos = np.zeros(len(everything), dtype=values.dtype)
+    for o, (sources, targets) in enumerate(cube):
+        where, present = cube_positions(work_array, everything, o)
+        rows, where = everything[present], where[present]
+        coeffs = values[where]
+        live = np.nonzero(coeffs)[0]
+        quos[:] = 0
+        if not len(live):
+            continue
+        rows, where, coeffs = rows[live], where[live], coeffs[live]
+        ranks = below.values[where]
+        if modulus is None:
+            leads = basis.values[basis.starts[ranks]]
+            assert leads.all()
+            quos[rows] = coeffs // leads
+            assert not (coeffs - quos[rows] * leads).any()
+        else:
+            assert inverses[ranks].all()
+            quos[rows] = coeffs * inverses[ranks] % modulus
+        spots, found = cube_positions(basis, ranks[:, None], sources)
+        places, kept = cube_positions(work_array, rows[:, None], targets)
+        pairs, steps = np.nonzero(found & kept)
+        factors = quos[rows[pairs]]
+        terms = basis.values[spots[pairs, steps]]
+        places = places[pairs, steps]
+        if native:
+            estimate = factors.astype(float) * terms
+            if not (np.abs(estimate) < native_limit).all():
+                raise OverflowError('entries too large for int64')
+        block = values[places] - factors * terms
+        if native and not fits_native(block):
+            raise OverflowError('entries too large for int64')
+        if modulus is not None:
+            block %= modulus
+        values[places] = block
+    return quos
+
+def solve(work_array, basis, native_basis, below, cube):
+    r"""
+    Run `eliminate` on int64 copies of `work_array` and `native_basis`
+    if possible, and fall back to the object arrays otherwise.
+
+    `native_basis` should be None if `basis` does not fit in int64, and
+    `basis` may be None if it should be made from `native_basis` only
+    when it is needed, in which case only the rows of `native_basis`
+    which `below` refers to are made into objects. Return the list of
+    quotients and the name of the backend used.
+    """
+    if native_basis is not None:
+        try:
+            native_work = work_array._replace(
+                values=native_array(work_array.values))
+            quos = eliminate(native_work, native_basis, below, cube)
+            return quos.tolist(), 'int64'
+        except OverflowError:
+            pass
+    if basis is None:
+        needed, ranks = np.unique(below.values, return_inverse=True)
+        basis = cubes_rows(native_basis, needed)
+        basis = basis._replace(values=basis.values.astype(object))
+        below = below._replace(values=ranks)
+    if work_array.values.dtype != object:
+        work_array = work_array._replace(
+            values=work_array.values.astype(object))
+    quos = eliminate(work_array, basis, below, cube)
+    return quos.tolist(), 'object'
+
+def word_primes(count):
+    r"""
+    Return the `count` largest primes below ``2**31``, so that products
+    of two residues fit in int64.
+
+    >>> word_primes(3)
+    [2147483647, 2147483629, 2147483587]
+    """
+    result = []
+    candidate = 1 << 31
+    while len(result) < count:
+        candidate -= 1
+        if all(candidate % d for d in xrange(2, int(candidate ** 0.5) + 1)):
+            result.append(candidate)
+    return result
+
+def inverses_modulo(values, modulus):
+    r"""
+    Return the array of inverses of the int64 array `values` modulo the
+    prime `modulus`, with 0 for the entries divisible by `modulus`.
+
+    >>> inverses_modulo(np.array([1, 2, 3, 7]), 7)
+    array([1, 4, 5, 0])
+    """
+    result = np.ones(values.shape, dtype=np.int64)
+    power = values.astype(np.int64) % modulus
+    exponent = modulus - 2
+    while exponent:
+        if exponent & 1:
+            result = result * power % modulus
+        power = power * power % modulus
+        exponent >>= 1
+    return result
+
+def chinese_remainder(residues, moduli):
+    r"""
+    Return the integer of smallest absolute value which is congruent to
+    `residues[i]` modulo `moduli[i]` for all `i`, where the moduli are
+    distinct primes.
+
+    >>> chinese_remainder([3, 1], [5, 7])
+    8
+    >>> chinese_remainder([4, 6], [5, 7])
+    -1
+    """
+    result, product = 0, 1
+    for residue, modulus in zip(residues, moduli):
+        step = (residue - result) * pow(product, modulus - 2, modulus)
+        result += product * (step % modulus)
+        product *= modulus
+    if 2 * result > product:
+        result -= product
+    return result
+
+def translation_table(lperm, blists=None):
+    r"""
+    Return the array mapping the rank of each blist `bl` to the rank of
+    the coordinate which `translated_fragment(lperm, -)` moves to `bl`.
+
+    The optional argument `blists` is the array of all blists of the
+    same size, in rank order.
+
+    >>> frag = {bl: rank_from_blist(bl) for bl in iter_blist(3)}
+    >>> tf = translated_fragment((1, 2, 0), frag)
+    >>> table = translation_table((1, 2, 0))
+    >>> all(tf[bl] == table[rank_from_blist(bl)] for bl in iter_blist(3))
+    True
+    """
+    return translation_tables([lperm], blists)[0]
+
+def translation_tables(lperms, blists=None):
+    r"""
+    Return the array whose row `t` is the `translation_table` of
+    `lperms[t]`, computed at once from `lperm_table`.
+    """
+    inverses = [[lperm.index(i) for i in range(len(lperm))]
+                for lperm in lperms]
+    if blists is None:
+        blists = blists_from_bfacts(bfacts_from_ranks(len(lperms[0])))
+    return lperm_table(inverses, blists)
+
+FragmentTable = namedtuple('FragmentTable', 'keys lower upper mask size')
+
+def fragment_table(flowups, n):
+    r"""
+    Return a lookup table for the root products in the list `flowups`
+    of fragments of size `n`, given as `Flowup` arrays.
+
+    Coordinate of rank `r` of fragment number `k` has the key
+    ``k * n! + r``, and the entries are sorted by key.
+    Entry `e` has the root product made of the roots
+    `(lower[e, d], upper[e, d])` for which `mask[e, d]` is set.
+
+    >>> table = fragment_table([
+    ...     Flowup(np.array([0]), np.array([[0]]), np.array([[1]])),
+    ...     Flowup(np.array([1]), np.zeros((1, 0)), np.zeros((1, 0))),
+    ...     ], 2)
+    >>> table.keys, table.lower, table.upper, table.mask
+    (array([0, 3]), array([[0],
+           [0]], dtype=int8), array([[1],
+           [0]], dtype=int8), array([[ True],
+           [False]]))
+    """
+    size = factorial(n)
+    width = max([1] + [f.lower.shape[1] for f in flowups])
+    keys = np.concatenate([np.zeros(0, dtype=int)] + [
+        k * size + f.ranks for k, f in enumerate(flowups)])
+    lower = np.zeros((len(keys), width), dtype=np.int8)
+    upper = np.zeros((len(keys), width), dtype=np.int8)
+    mask = np.zeros((len(keys), width), dtype=bool)
+    e = 0
+    for f in flowups:
+        rows, degree = f.lower.shape
+        lower[e:e+rows, :degree] = f.lower
+        upper[e:e+rows, :degree] = f.upper
+        mask[e:e+rows, :degree] = True
+        e += rows
+    return FragmentTable(keys, lower, upper, mask, size)
+
+def flowup_rows(path, part, width):
+    r"""
+    Return the arrays `(lower, upper, mask)` of a `fragment_table` of
+    the flowup fragments of `path`, for its entries at the coordinates
+    of a block `part` of rows of the cubes `above` of `size_tables`
+    (see `size_block`), with `width` columns.
+
+    The flowup coordinates of a bfact are those of its row, and its
+    roots come from `prefix_roots`, the lower ends of the mobile roots
+    being read off `staircase`. The roots of each root product are in the same order
+    as the slots of `prefix_roots`, fixed roots first.
+    """
+    n = len(path)
+    start = int(part.rows[0])
+    stop = start + len(part.starts)
+    roots = prefix_roots(path)
+    slots = [(v, i) for i in range(n) for v in range(i)]
+    slots += [(jj, i) for i in range(n) for jj in range(i + 1)]
+    ends = np.array(slots, dtype=np.int8).reshape(-1, 2)
+    chosen = np.hstack([roots.fixed[start:stop], roots.mobile[start:stop]])
+    bfacts, spots = np.nonzero(chosen)
+    columns = np.cumsum(chosen, axis=1, dtype=np.int8)[bfacts, spots] - 1
+    lower, upper, mask, mobile, source = [
+        np.zeros((stop - start, width), dtype=dtype)
+        for dtype in (np.int8, np.int8, bool, bool, int)]
+    lower[bfacts, columns], upper[bfacts, columns] = ends[spots].T
+    mask[bfacts, columns] = True
+    mobile[bfacts, columns] = spots >= roots.fixed.shape[1]
+    source[bfacts, columns] = np.maximum(spots - roots.fixed.shape[1], 0)
+    rows = part.rows - start
+    lower = np.where(
+        mobile[rows], staircase(n)[part.values[:, None], source[rows]],
+        lower[rows])
+    return lower, upper[rows], mask[rows]
+
+def flowup_width(path):
+    r"""
+    Return the largest degree of the flowup fragments of `path`.
+
+    >>> flowup_width((0, 0, 0)), flowup_width((0, 1, 2))
+    (3, 0)
+    """
+    roots = prefix_roots(path)
+    return int((roots.mobile.sum(axis=1) + roots.fixed.sum(axis=1)).max())
+
+def path_table(path, block=1 << 10):
+    r"""
+    Return the `fragment_table` of the flowup fragments of all bfacts
+    for `path`, built `block` bfacts at a time with `flowup_rows`.
+    It only differs from the table of the `flowup` arrays by the order
+    of the roots in each root product.
+
+    >>> table = path_table((0, 0, 1, 1), 5)
+    >>> flowups = [flowup(bfact, (0, 0, 1, 1)) for bfact in iter_bfact(4)]
+    >>> expected = fragment_table(flowups, 4)
+    >>> (table.keys == expected.keys).all()
+    True
+    >>> def roots(t):
+    ...     codes = _root_codes(4)[t.lower, t.upper] + 1
+    ...     return np.sort(codes * t.mask, axis=1)
+    >>> (roots(table) == roots(expected)).all()
+    True
+    """
+    n = len(path)
+    tables, size = size_tables(n, False), factorial(n)
+    width = max(1, flowup_width(path))
+    keys = tables.above.rows.astype(np.int64) * size + tables.above.values
+    parts = [
+        flowup_rows(path, size_block(
+            tables, 'above', start, min(start + block, size)), width)
+        for start in range(0, size, block)]
+    return FragmentTable(keys, *[
+        np.concatenate([part[f] for part in parts]) for f in range(3)
+        ] + [size])
+
+def _swaps_compute(n):
+    r"""
+    Return the pairs of positions `(p, q)` with `p < q` as two arrays,
+    and the array whose entry `[r, s]` is the rank of the blist of rank
+    `r` with the entries at positions `p[s]` and `q[s]` swapped.
+
+    >>> p, q, swapped = swapped_ranks(3)
+    >>> p, q, swapped[0]
+    (array([0, 0, 1]), array([1, 2, 2]), array([3, 5, 1]))
+    """
+    p, q = np.array(
+        list(it.combinations(range(n), 2)), dtype=int).reshape(-1, 2).T
+    blists = all_blists(n)
+    swapped = np.repeat(blists[:, None, :], len(p), axis=1)
+    pairs = np.arange(len(p))
+    swapped[:, pairs, p] = blists[:, q]
+    swapped[:, pairs, q] = blists[:, p]
+    return p, q, ranks_from_blists(swapped)
+
+swapped_ranks = memoize('swapped_ranks', maxsize=2)(_swaps_compute)
+
+def _root_codes(n):
+    r"""
+    Return the array whose entry `[a, b]` is twice the `root_index` of
+    the root `{a, b}`, plus one if `a > b`; or -2 if `a == b`.
+
+    >>> _root_codes(3)
+    array([[-2,  0,  2],
+           [ 1, -2,  4],
+           [ 3,  5, -2]], dtype=int16)
+    """
+    a, b = np.indices((n, n))
+    result = 2*root_index(np.minimum(a, b), np.maximum(a, b)) + (a > b)
+    result[a == b] = -2
+    return result.astype(np.int16)
+
+def _projected(table, entries, fro, to, codes):
+    r"""
+    Return the root products `entries` of `table`, with `fro` replaced
+    by `to` in each row, as a triple of arrays: whether the product is
+    zero, the parity of its sign, and its sorted `root_index` values.
+    The array `codes` comes from `_root_codes`.
+    """
+    mask = table.mask[entries]
+    lower, upper = table.lower[entries], table.upper[entries]
+    lower = np.where(lower == fro[:, None], to[:, None], lower)
+    upper = np.where(upper == fro[:, None], to[:, None], upper)
+    coded = codes.ravel().take(lower * len(codes) + upper)
+    flips = (coded & mask).sum(axis=1) & 1
+    coded = np.where(mask, coded >> 1, len(codes) ** 2)
+    zero = (coded < 0).any(axis=1)
+    coded.sort(axis=1)
+    return zero, flips, coded
+
+def invalid_fragments(table, path, chunk=1 << 14):
+    r"""
+    Return the sorted array of the numbers of the fragments in `table`
+    which are not valid for `path`, in the sense of `is_fragment`.
+
+    This checks the same conditions as `is_fragment`, for many entries
+    at once: the swaps are looked up in `swapped_ranks`, the boxes in
+    `boxes_bitmasks`, and the projected root products are compared as
+    sorted arrays of root codes. It goes through `chunk` entries at a
+    time.
+
+    >>> test_invalid_fragments()
+    """
+    n = len(path)
+    p, q, swapped = swapped_ranks(n)
+    blists = all_blists(n)
+    masks = np.array(boxes_bitmasks(path), dtype=int)
+    codes = _root_codes(n)
+    bad = []
+    for start in range(0, len(table.keys), chunk):
+        entries = np.arange(start, min(start + chunk, len(table.keys)))
+        frags, ranks = np.divmod(table.keys[entries], table.size)
+        fro, to = blists[ranks][:, p], blists[ranks][:, q]
+        checked = (fro > to) & ((masks[to] >> fro) & 1 == 1)
+        rows, pairs = np.nonzero(checked)
+        fro, to = fro[rows, pairs], to[rows, pairs]
+        entries, frags = entries[rows], frags[rows]
+        found, below = table_lookup(
+            table, frags, swapped[ranks[rows], pairs])
+        zero, flips, roots = _projected(table, entries, fro, to, codes)
+        valid = zero & ~found
+        zero_b, flips_b, roots_b = _projected(
+            table, below, fro[found], to[found], codes)
+        valid[found] = (zero[found] & zero_b) | (
+            ~zero[found] & ~zero_b & (flips[found] == flips_b) &
+            (roots[found] == roots_b).all(axis=1))
+        bad.append(frags[~valid])
+    return np.unique(np.concatenate([np.zeros(0, dtype=int)] + bad))
+
+def table_find(table, coords):
+    r"""
+    Find the entries of `table` at `coords`, where row `k` of `coords`
+    holds ranks of coordinates of fragment number `k`.
+
+    Return a pair `(found, entries)`, where `found` is a boolean array
+    of the same shape as `coords` (negative ranks are never found) and
+    `entries` lists the entries which were found, in order.
+
+    >>> empty = np.zeros((1, 0))
+    >>> table = fragment_table([
+    ...     Flowup(np.array([0]), empty, empty),
+    ...     Flowup(np.array([1]), empty, empty),
+    ...     ], 2)
+    >>> table_find(table, np.array([[0, 1], [1, -1]]))
+    (array([[ True, False],
+           [ True, False]]), array([0, 1]))
+    """
+    return table_lookup(table, np.arange(len(coords))[:, None], coords)
+
+def table_lookup(table, frags, coords):
+    r"""
+    Find the entries of `table` at the coordinates of ranks `coords`
+    of the fragments numbered `frags`, which are broadcast together,
+    in the same way as `table_find`.
+    """
+    wanted = np.asarray(frags, dtype=np.int64) * table.size + coords
+    where = np.searchsorted(table.keys, wanted)
+    where = np.minimum(where, max(0, len(table.keys)-1))
+    found = (coords >= 0) & (table.keys[where] == wanted)
+    return found, where[found]
+
+def root_products(diffs, mask, modulus=None):
+    r"""
+    Return the object array of products of the entries of `diffs`
+    along their last axis, ignoring the entries where `mask` is unset.
+    If `modulus` is not None, return the int64 array of the products
+    modulo `modulus` instead, which should be below ``2**31``.
+
+    The products are done in int64 when they are known to be small
+    enough, and with Python integers otherwise.
+
+    >>> root_products(np.array([[2, -3], [7, 5]]),
+    ...               np.array([[True, True], [True, False]]))
+    array([-6, 7], dtype=object)
+    >>> root_products(np.array([[7]*30]), np.array([[True]*30]))[0] == 7**30
+    True
+    >>> root_products(np.array([[2, -3], [7, 5]]),
+    ...               np.array([[True, True], [True, False]]), 5)
+    array([4, 2])
+    """
+    if modulus is not None:
+        diffs = np.where(mask, diffs, 1).astype(np.int64) % modulus
+        result = np.ones(diffs.shape[:-1], dtype=np.int64)
+        for d in range(diffs.shape[-1]):
+            result = result * diffs[..., d] % modulus
         return result
-def _indices_below_compute(bfact):
-    result = {}
-    assert is_bfact(bfact)
-    n = len(bfact)
-    maxoff = (0,) + (1,)*(n-1)
-    bfact = tuple(b-m for b, m in zip(bfact, maxoff))
-    for offset in it.product(*([(0,)] + [(0, 1)]*(n-1))):
-        ofact = tuple(b+o for b, o in zip(bfact, offset))
-        if is_bfact(ofact):
-            olist = blist_from_bfact(ofact)
-            result[offset] = olist
+    diffs = np.where(mask, diffs, 1).astype(np.int64)
+    with np.errstate(divide='ignore'):
+        size = np.log2(np.abs(diffs)).sum(axis=-1)
+    result = np.prod(diffs, axis=-1).astype(object)
+    big = size >= 62
+    if big.any():
+        result[big] = np.prod(diffs[big].astype(object), axis=-1)
     return result
 
-def frag_at(n, frag, indices):
+def left_values(table, entries, coords, positions, modulus=None):
+    r"""
+    Return the values at ``L_i = i`` of the root products `entries`
+    of `table`, moved to the blists of rank `coords` (modulo `modulus`
+    if it is not None, see `root_products`).
+
+    Row `r` of `positions` is the inverse of the blist of rank `r`.
+    """
+    where = positions[coords]
+    rows = np.arange(len(entries))[:, None]
+    diffs = (where[rows, table.lower[entries]] -
+             where[rows, table.upper[entries]])
+    return root_products(diffs, table.mask[entries], modulus)
+
+def right_values(table, entries, coords, positions, modulus=None):
+    r"""
+    Return the values at ``R_i = i`` of the root products `entries`
+    of `table`, which do not depend on the blists they are moved to
+    (modulo `modulus` if it is not None, see `root_products`).
+    """
+    diffs = (table.lower[entries].astype(int) -
+             table.upper[entries].astype(int))
+    return root_products(diffs, table.mask[entries], modulus)
+
+valuations = {
+    'left': left_values,
+    'right': right_values,
+    }
+
+translation_invariant = ('right',)
+
+def valued_array(table, moved, coords, positions, valued, modulus=None,
+                 chunk=1 << 16):
+    r"""
+    Return the `Cubes` of values of the fragments in `table`, translated
+    according to the `translation_table` `moved`, at the blists whose
+    ranks are the values of the `Cubes` `coords` (row `k` is for
+    fragment number `k`). The values are computed by the function
+    `valued` from `valuations`, `chunk` entries at a time, as Python
+    integers, or as int64 residues modulo `modulus` if it is not None.
+    """
+    found, entries = table_lookup(table, coords.rows, moved[coords.values])
     result = np.zeros(
-        (1,) + (2,)*(n-1),
-        dtype=object,
-        )
-    for offset, olist in indices.items():
-        if olist in frag:
-            result[offset] = frag[olist]
-    return result
+        len(found), dtype=object if modulus is None else np.int64)
+    hits = np.nonzero(found)[0]
+    for start in range(0, len(hits), chunk):
+        part = hits[start:start+chunk]
+        result[part] = valued(
+            table, entries[start:start+chunk], coords.values[part],
+            positions, modulus)
+    return coords._replace(values=result)
 
-# ---------------------------------------------------------
+def moved_array(table, moved, coords, values):
+    r"""
+    Return the same `Cubes` as `valued_array`, for a side in
+    `translation_invariant`, by gathering the array `values` of the
+    values of the entries of `table` through `moved` instead of valuing
+    the entries again. The result has the dtype of `values`.
 
-def compute_left(path):
+    The basis vectors of `path_basis` are in the same layout as the
+    entries of its table, so their values can be used for `values`.
+
+    >>> table = path_table((0, 0, 1))
+    >>> tables = size_tables(3, False)
+    >>> values = valued_array(table, np.arange(6), tables.above,
+    ...                       tables.positions, right_values).values
+    >>> moved = tables.moved[2, 0, 1]
+    >>> expected = valued_array(table, moved, tables.below,
+    ...                         tables.positions, right_values).values
+    >>> (moved_array(table, moved, tables.below, values).values ==
+    ...  expected).all()
+    True
+    """
+    found, entries = table_lookup(table, coords.rows, moved[coords.values])
+    result = np.zeros(len(found), dtype=values.dtype)
+    result[found] = values[entries]
+    return coords._replace(values=result)
+
+SizeTables = namedtuple(
+    'SizeTables', 'blists positions below above cube moved')
+
+def _size_tables_compute(n, outline):
+    r"""
+    Return the tables used by `compute_hess` which only depend on the
+    size `n` of the path:
+
+     - `blists`: the array of blists in rank order
+     - `positions`: the array of their inverses
+     - `below`, `above`: the `offset_cubes` of the cubes of offsets
+       below and above each bfact, which are only outlines if
+       `outline` is set, for working out of core (see `size_block`);
+       it is not optional, so that all callers share the cache
+     - `cube`: the elimination steps from `offset_cube`
+     - `moved`: the `translation_table` of each translator, in int32
+
+    >>> tables = size_tables(3, False)
+    >>> below, above = tables.below, tables.above
+    >>> below.values[below.rows == 5], above.values[above.rows == 0]
+    (array([1, 2, 4, 5], dtype=int32), array([0, 1, 3, 4], dtype=int32))
+    """
+    blists = all_blists(n)
+    lperms = sorted(translators(n))
+    moved = {
+        lperm: translation_table(lperm, blists).astype(np.int32)
+        for lperm in lperms}
+    return SizeTables(
+        blists, np.argsort(blists, axis=1).astype(np.int8),
+        offset_cubes(n, size_shift(n, 'below'), outline=outline),
+        offset_cubes(n, size_shift(n, 'above'), outline=outline),
+        offset_cube(n), moved)
+
+size_tables = memoize('size_tables', maxsize=2)(_size_tables_compute)
+
+def keep_sizes(count):
+    r"""
+    Let the caches of the tables which only depend on the size of the
+    path keep the tables of at least `count` sizes, so that they are
+    not recomputed when `iter_path_tree` goes back and forth between
+    that many sizes.
+
+    >>> keep_sizes(3); size_tables.maxsize
+    3
+    >>> keep_sizes(2); size_tables.maxsize
+    3
+    """
+    for memo in _size_memos:
+        memo.maxsize = max(memo.maxsize, count)
+
+_size_memos = [staircase, compressed_offsets, swapped_ranks, size_tables]
+
+def path_basis(path, sides, store=None, validate=False, block=None):
+    r"""
+    Return the `fragment_table` of the flowup fragments of `path`, and
+    the lists of `Cubes` of object and int64 values (or None if they do
+    not fit) of its basis vectors for each of the given `sides`.
+
+    If `store` is not None, it is a directory in which these are kept
+    between runs: the table (see `path_table_entry`) and the int64
+    basis arrays are saved there the first time, and memory-mapped from
+    there afterwards, in the entries given by `path_entry`. A side whose
+    basis does not fit in int64 has an empty entry.
+
+    If `block` is not None, the arrays are kept out of core: the entries
+    in `store` are built `block` bfacts at a time, the object bases are
+    not made (their list holds None), and the `Cubes` of the bases are
+    those of the outline `size_tables`. The sides whose basis does not
+    fit in int64 are the exception: their object basis is made in core,
+    and a warning suggests `compute_hess_modular` instead.
+
+    If `validate` is set, the flowup fragments are checked with
+    `check_table`.
+
+    >>> root = tempfile.mkdtemp()
+    >>> table, basis, native = path_basis((0, 0, 1), ['left'], root, True)
+    >>> stored = path_basis((0, 0, 1), ['left', 'right'], root)
+    >>> all((a == b).all() for a, b in zip(table, stored[0])[:-1])
+    True
+    >>> stored_values = stored[2][0].values
+    >>> (basis[0].values == stored_values).all()
+    True
+    >>> isinstance(stored_values, np.memmap)
+    True
+    >>> streamed = path_basis(
+    ...     (0, 0, 1), ['left', 'right'], root + '/s', block=4)
+    >>> all((a == b).all() for a, b in zip(table, streamed[0])[:-1])
+    True
+    >>> streamed[1], (streamed[2][1].values == stored[2][1].values).all()
+    ([None, None], True)
+    >>> shutil.rmtree(root)
+    >>> test_overflow()
+    """
+    n = len(path)
+    tables = size_tables(n, block is not None)
+    identity = np.arange(factorial(n))
+    if store is not None:
+        table = path_table_entry(store, path, block)
+    else:
+        table = path_table(path)
+    if validate:
+        check_table(table, path)
+    basis, native_basis = [], []
+    for side in sides:
+        stored = None
+        if store is not None:
+            entry = path_entry(store, path, side)
+            if block is not None:
+                build_basis_entry(entry, table, tables, side, block)
+            stored = load_arrays(entry)
+        if stored is not None and 'basis' in stored:
+            native_basis.append(tables.above._replace(
+                values=stored['basis']))
+            basis.append(None if block is not None else
+                         tables.above._replace(
+                             values=native_basis[-1].values.astype(object)))
+            continue
+        if block is not None:
+            logger.warning('path %s side %s: the basis does not fit in '
+                           'int64, so it is held in core (see --modular)',
+                           path, side)
+        basis.append(tables.above._replace(values=np.concatenate([
+            valued_array(table, identity, part, tables.positions,
+                         valuations[side]).values
+            for start, part in size_blocks(tables, 'above', block)])))
+        try:
+            native_basis.append(basis[-1]._replace(
+                values=native_array(basis[-1].values)))
+        except OverflowError:
+            native_basis.append(None)
+        if store is not None and stored is None:
+            save_arrays(entry, {} if native_basis[-1] is None else
+                        {'basis': native_basis[-1].values})
+    return table, basis, native_basis
+
+def path_entry(store, path, name):
+    r"""
+    Return the directory of the entry `name` (either 'table' or a side)
+    of `path_basis` for `path` in `store`. Entries are grouped under the
+    `result_hash` of `path_basis`, so that a change to any code it may
+    call starts a new group.
+    """
+    return os.path.join(
+        store, result_hash(path_basis), ''.join(map(str, path)), name)
+
+def path_table_entry(store, path, block=None):
+    r"""
+    Return the `path_table` of `path`, memory-mapped from its entry in
+    `store`, which is made the first time. If `block` is not None, the
+    entry is built by `build_table_entry` without holding the table in
+    memory.
+    """
+    entry = path_entry(store, path, 'table')
+    if block is not None:
+        build_table_entry(entry, path, block)
+    stored = load_arrays(entry)
+    if stored is None:
+        table = path_table(path)
+        arrays = table._asdict()
+        del arrays['size']
+        save_arrays(entry, arrays)
+        return table
+    return FragmentTable(*[
+        stored[field] for field in FragmentTable._fields[:-1]
+        ] + [factorial(len(path))])
+
+def check_table(table, path):
+    r"""
+    Check the flowup fragments of `path` in `table` with
+    `invalid_fragments`, and raise a ValueError if any of them is not
+    valid, after logging the offending bfacts.
+    """
+    bad = invalid_fragments(table, path)
+    for k in bad:
+        logger.error('invalid flowup fragment for bfact %s and path %s',
+                     bfact_from_rank(k, len(path)), path)
+    if len(bad):
+        raise ValueError('%d invalid flowup fragments for path %s' % (
+            len(bad), path))
+
+def basis_values(table, tables, side, out=None, block=1 << 14,
+                 modulus=None):
+    r"""
+    Return the int64 values of the basis vectors of `side` for the
+    `fragment_table` `table`, in the layout of the cubes `above` of the
+    `SizeTables` `tables` of the same size. They are computed `block`
+    bfacts at a time, and written into `out` if it is not None. Raise
+    `OverflowError` if they do not fit in int64.
+
+    If `modulus` is not None, return their residues modulo `modulus`
+    instead, which are computed directly (see `valued_array`).
+
+    >>> table = path_table((0, 0, 1))
+    >>> basis_values(table, size_tables(3, False), 'left', block=4)
+    array([1, 1, 1, 1, 1, 2, 1, 2, 2, 1, 1, 2, 2, 1, 1])
+    >>> basis_values(table, size_tables(3, True), 'left', block=4, modulus=2)
+    array([1, 1, 1, 1, 1, 0, 1, 0, 0, 1, 1, 0, 0, 1, 1])
+    """
+    above, rows = tables.above, len(tables.blists)
+    identity = np.arange(rows)
+    if out is None:
+        out = np.zeros(cubes_size(above), dtype=np.int64)
+    for start, part in size_blocks(tables, 'above', block):
+        first = above.starts[start]
+        values = valued_array(
+            table, identity, part, tables.positions, valuations[side],
+            modulus).values
+        if modulus is None:
+            values = native_array(values)
+        out[first:first+len(part.values)] = values
+    return out
+
+def build_table_entry(entry, path, block=1 << 14):
+    r"""
+    Build the entry `entry` of `path_table_entry` for `path` without
+    holding it in memory, unless it already exists.
+
+    The keys and the flowup fragments from `flowup_rows` are written at
+    most `block` bfacts at a time, straight into memory-mapped arrays
+    in the same layout as `path_table`, from the blocks of the outline
+    `size_tables`.
+    """
+    n = len(path)
+    tables = size_tables(n, True)
+    above, size = tables.above, factorial(n)
+    def fill(tmp):
+        width = max(1, flowup_width(path))
+        total = cubes_size(above)
+        keys = new_array(tmp, 'keys', (total,), int)
+        lower = new_array(tmp, 'lower', (total, width), np.int8)
+        upper = new_array(tmp, 'upper', (total, width), np.int8)
+        mask = new_array(tmp, 'mask', (total, width), bool)
+        for start, part in size_blocks(tables, 'above', min(block, 1 << 10)):
+            first = above.starts[start]
+            last = first + len(part.values)
+            keys[first:last] = part.rows.astype(np.int64) * size + part.values
+            (lower[first:last], upper[first:last],
+             mask[first:last]) = flowup_rows(path, part, width)
+        for array in (keys, lower, upper, mask):
+            array.flush()
+    build_arrays(entry, fill)
+
+def build_basis_entry(entry, table, tables, side, block=1 << 14):
+    r"""
+    Build the entry `entry` of `path_basis` for the basis of `side` of
+    the `fragment_table` `table`, with the `SizeTables` `tables`,
+    unless it already exists. The basis is computed by `basis_values`,
+    `block` bfacts at a time, straight into a memory-mapped array, and
+    the entry is left empty if it does not fit in int64.
+    """
+    def fill(tmp):
+        out = new_array(tmp, 'basis', (cubes_size(tables.above),), np.int64)
+        try:
+            basis_values(table, tables, side, out, block)
+        except OverflowError:
+            del out
+            os.remove(os.path.join(tmp, 'basis.npy'))
+        else:
+            out.flush()
+    build_arrays(entry, fill)
+
+def basis_degrees(table):
+    r"""
+    Return the list of the degrees of the basis vectors in `table`,
+    in bfact rank order.
+    """
+    found, entries = table_find(table, np.arange(table.size)[:, None])
+    return table.mask[entries].sum(axis=1).tolist()
+
+def compute_hess(path, sides=('left', 'right'), store=None, validate=False,
+                 block=None, lperms=None):
+    r"""
+    Compute the Hessenberg characters of `path` for each of the given
+    `sides`, which should be keys of `valuations`.
+
+    The tables which do not depend on the path come from `size_tables`,
+    so they are shared between all paths of the same size. All flowup
+    fragments are gathered in a single `fragment_table`,
+    which is shared between the sides. For each translator and side,
+    the work arrays of all bfacts are built directly from the table by
+    `valued_array`, stacked by rank and solved together by `solve`, in
+    int64 when the numbers are small enough. The backends used for each
+    side are logged. For the sides in `translation_invariant`, the
+    entries are only valued once, for the basis, and the work arrays
+    are gathered from it by `moved_array`.
+
+    Return a dict mapping each side to its coefficients `csf[t, deg]`,
+    for all translators `t`, or only for those in `lperms` if it is not
+    None (see `work_units`).
+
+    The flowup table and the basis come from `path_basis`, which keeps
+    them in `store` if it is not None, and checks them if `validate`
+    is set. If `block` is not None, they are kept out of core in
+    `store`, and the work arrays are built and solved `block` bfacts at
+    a time, from the blocks of the outline `size_tables`, so that only
+    the layout of the cubes and one block of work arrays need to be
+    held in memory.
+
+    >>> compute_hess((0, 0, 1), ('right',))['right'] == compute_right((0, 0, 1))
+    True
+    >>> root = tempfile.mkdtemp()
+    >>> streamed = compute_hess((0, 0, 1, 2), ('left',), root, False, 5)
+    >>> streamed == compute_hess((0, 0, 1, 2), ('left',))
+    True
+    >>> shutil.rmtree(root)
+    >>> csf = compute_hess((0, 0, 1), ('left',), lperms=[(2, 0, 1)])['left']
+    >>> sorted(csf.items())
+    [(((2, 0, 1), 0), 1), (((2, 0, 1), 1), 1), (((2, 0, 1), 2), 1)]
+    >>> test_valuations()
+    """
     assert is_path(path)
     n = len(path)
-    maxoff = (0,) + (1,)*(n-1)
-    basis = {}
-    for bfact in iter_bfact(n):
-        basis[bfact] = frag_at(
-            n,
-            lvaluated_fragment(flowup(bfact, path)),
-            indices_above(bfact),
-            )
-    csf = defaultdict(int)
-    for t in translators(n):
-        for bfact in iter_bfact(n):
-            f = flowup(bfact, path)
-            deg = len(f[blist_from_bfact(bfact)])
-            work_array = frag_at(
-                n,
-                lvaluated_fragment(translated_fragment(t, f)),
-                indices_below(bfact),
-                )
-            for offset in it.product(*([(0,)] + [(0, 1)]*(n-1))):
-                coeff = work_array[offset]
-                if coeff == 0:
-                    quo = 0
+    tables = size_tables(n, block is not None)
+    positions, cube = tables.positions, tables.cube
+    table, basis, native_basis = path_basis(
+        path, sides, store, validate, block)
+    degs = basis_degrees(table)
+    csfs = [defaultdict(int) for side in sides]
+    backends = [defaultdict(int) for side in sides]
+    values = [
+        (objects if native is None else native).values
+        if side in translation_invariant else None
+        for side, objects, native in zip(sides, basis, native_basis)]
+    for start, part in size_blocks(tables, 'below', block):
+        for t, moved in selected_translators(tables, lperms):
+            for k, side in enumerate(sides):
+                if values[k] is not None:
+                    work_array = moved_array(table, moved, part, values[k])
                 else:
-                    ofact = tuple(b+o-m for b, o, m in zip(bfact, offset, maxoff))
-                    ovect = basis[ofact]
-                    olead = ovect[(0,)*n]
-                    quo, rem = divmod(coeff, olead)
-                    assert rem == 0
-                    wa_indices = [
-                        slice(None, None, None) if i == 0 else 1
-                        for i in offset
-                        ]
-                    ov_indices = [
-                        slice(None, None, None) if i == 0 else 0
-                        for i in offset
-                        ]
-                    work_array[wa_indices] -= quo * ovect[ov_indices]
-            csf[t,deg] += quo
-    return csf
+                    work_array = valued_array(
+                        table, moved, part, positions, valuations[side])
+                quos, backend = solve(
+                    work_array, basis[k], native_basis[k], part, cube)
+                backends[k][backend] += 1
+                for deg, quo in zip(degs[start:], quos):
+                    csfs[k][t,deg] += quo
+    for side, counts in zip(sides, backends):
+        logger.info('path %s side %s used backends %s',
+                    path, side, dict(counts))
+    return dict(zip(sides, csfs))
 
-def compute_right(path):
-    assert is_path(path)
+def modular_primes(n, bound=None):
+    r"""
+    Return the primes used by `compute_hess_modular` for paths of size
+    `n`: enough of the `word_primes` for their product to exceed twice
+    `bound`, and one more to check the results.
+
+    The default `bound` is ``n!``: the coefficients are values of
+    characters of representations of dimension at most ``n!``. A wrong
+    bound is caught by the extra prime.
+
+    >>> modular_primes(5)
+    [2147483647, 2147483629]
+    >>> len(modular_primes(5, 1 << 80))
+    4
+    """
+    if bound is None:
+        bound = factorial(n)
+    count, product = 0, 1
+    while product <= 2 * bound:
+        count += 1
+        product *= word_primes(count)[-1]
+    return word_primes(count + 1)
+
+def modular_pass(task):
+    r"""
+    Run the elimination of `compute_hess` modulo a prime, for a task
+    `(path, sides, modulus, store, block, lperms, table)`. Return a list
+    with a dict for each side, mapping `(lperm, deg)` to the residue of
+    the coefficient.
+
+    The flowup fragments come from the `fragment_table` `table`, or
+    from its entry in `store` if it is None (see `path_table_entry`).
+    The int64 bases which `path_basis` stored there are reduced, and
+    the other bases are computed directly modulo the prime by
+    `basis_values`, so that the exact bases are never needed.
+
+    If `block` is not None, the elimination goes `block` bfacts at a
+    time, and the reduced bases are kept in temporary files in `store`.
+    """
+    path, sides, modulus, store, block, lperms, table = task
     n = len(path)
-    maxoff = (0,) + (1,)*(n-1)
-    basis = {}
-    for bfact in iter_bfact(n):
-        basis[bfact] = frag_at(
-            n,
-            rvaluated_fragment(flowup(bfact, path)),
-            indices_above(bfact),
-            )
-    csf = defaultdict(int)
-    for t in translators(n):
-        for bfact in iter_bfact(n):
-            f = flowup(bfact, path)
-            deg = len(f[blist_from_bfact(bfact)])
-            work_array = frag_at(
-                n,
-                rvaluated_fragment(translated_fragment(t, f)),
-                indices_below(bfact),
-                )
-            for offset in it.product(*([(0,)] + [(0, 1)]*(n-1))):
-                coeff = work_array[offset]
-                if coeff == 0:
-                    quo = 0
+    tables = size_tables(n, block is not None)
+    if table is None:
+        table = path_table_entry(store, path, block)
+    degs = np.array(basis_degrees(table))
+    result = []
+    for k, side in enumerate(sides):
+        stored = {}
+        if store is not None:
+            stored = load_arrays(path_entry(store, path, side)) or {}
+        reduced = None
+        if block is not None:
+            reduced = np.memmap(tempfile.TemporaryFile(dir=store),
+                                dtype=np.int64,
+                                shape=(cubes_size(tables.above),))
+        if 'basis' not in stored:
+            reduced = basis_values(
+                table, tables, side, reduced, block or 1 << 14, modulus)
+        elif block is None:
+            reduced = stored['basis'] % modulus
+        else:
+            values = stored['basis']
+            step = block << (n - 1)
+            for start in range(0, len(values), step):
+                reduced[start:start+step] = values[start:start+step] % modulus
+        reduced = tables.above._replace(values=reduced)
+        translated = selected_translators(tables, lperms)
+        sums = {t: np.zeros(max(degs) + 1, dtype=np.int64)
+                for t, moved in translated}
+        for start, part in size_blocks(tables, 'below', block):
+            for t, moved in translated:
+                if side in translation_invariant:
+                    work_array = moved_array(
+                        table, moved, part, reduced.values)
                 else:
-                    ofact = tuple(b+o-m for b, o, m in zip(bfact, offset, maxoff))
-                    ovect = basis[ofact]
-                    olead = ovect[(0,)*n]
-                    quo, rem = divmod(coeff, olead)
-                    assert rem == 0
-                    wa_indices = [
-                        slice(None, None, None) if i == 0 else 1
-                        for i in offset
-                        ]
-                    ov_indices = [
-                        slice(None, None, None) if i == 0 else 0
-                        for i in offset
-                        ]
-                    work_array[wa_indices] -= quo * ovect[ov_indices]
-            csf[t,deg] += quo
-    return csf
+                    work_array = valued_array(
+                        table, moved, part, tables.positions,
+                        valuations[side], modulus)
+                quos = eliminate(
+                    work_array, reduced, part, tables.cube, modulus)
+                np.add.at(sums[t], degs[start:start+len(quos)], quos)
+        residues = {}
+        for t, moved in translated:
+            for deg in set(degs.tolist()):
+                residues[t, deg] = int(sums[t][deg] % modulus)
+        result.append(residues)
+    return result
+
+def compute_hess_modular(path, sides=('left', 'right'), primes=None,
+                         store=None, validate=False, jobs=1, block=None,
+                         lperms=None):
+    r"""
+    Compute the same coefficients as `compute_hess`, by running the
+    elimination modulo each of the `primes` (by default, from
+    `modular_primes`) with `modular_pass`, in `jobs` processes, and
+    out of core if `block` is not None, for the translators in `lperms`
+    if it is not None (see `compute_hess`).
+
+    The coefficients are reconstructed from all primes but the last
+    with `chinese_remainder`, and checked modulo the last one: this
+    fails with an `ArithmeticError` if some division was not exact, or
+    if there were not enough primes for the size of the coefficients.
+
+    >>> test_modular()
+    >>> compute_hess_modular((0, 0, 1, 1), ('right',), [5, 7])
+    Traceback (most recent call last):
+    ...
+    ArithmeticError: path (0, 0, 1, 1) side right: check modulo 7 failed
+    """
+    if primes is None:
+        primes = modular_primes(len(path))
+    # The passes memory-map the stored table rather than get a copy.
+    if store is None:
+        table = checked = path_table(path)
+    else:
+        table, checked = None, path_table_entry(store, path, block)
+    if validate:
+        check_table(checked, path)
+    tasks = [(path, sides, p, store, block, lperms, table) for p in primes]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(modular_pass, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(modular_pass, tasks)
+    csfs = []
+    for k, side in enumerate(sides):
+        csf = {}
+        for key, residue in results[-1][k].iteritems():
+            csf[key] = chinese_remainder(
+                [r[k][key] for r in results[:-1]], primes[:-1])
+            if csf[key] % primes[-1] != residue:
+                raise ArithmeticError('path %s side %s: check modulo %d failed'
+                                      % (path, side, primes[-1]))
+        csfs.append(csf)
+    logger.info('path %s used the primes %s', path, primes)
+    return dict(zip(sides, csfs))
+
+def selected_translators(tables, lperms=None):
+    r"""
+    Return the sorted list of the pairs `(lperm, moved)` of the
+    translation tables in the `SizeTables` `tables`, for all translators
+    or only for those in `lperms` if it is not None.
+
+    >>> [t for t, moved in selected_translators(size_tables(3, False))]
+    [(0, 1, 2), (1, 0, 2), (2, 0, 1)]
+    >>> [t for t, moved in selected_translators(size_tables(3, False), [(2, 0, 1)])]
+    [(2, 0, 1)]
+    """
+    if lperms is None:
+        lperms = tables.moved
+    return [(t, tables.moved[t]) for t in sorted(lperms)]
+
+def work_units(path, sides=('left', 'right'), lperms=None):
+    r"""
+    Return the list of the pairs `(side, lperm)` for which the
+    coefficients of `path` can be computed separately, as partial
+    results (see `save_partial` and `merge_partials`), for the given
+    `sides` and for all translators, or those in `lperms` if it is not
+    None.
+
+    >>> work_units((0, 0), ['left'])
+    [('left', (0, 1)), ('left', (1, 0))]
+    >>> work_units((0, 0), ['left'], [(0, 2)])
+    Traceback (most recent call last):
+    ...
+    ValueError: (0, 2) is not a translator for size 2
+    """
+    known = translators(len(path))
+    for t in lperms or ():
+        if t not in known:
+            raise ValueError('%s is not a translator for size %d' % (
+                t, len(path)))
+    return [(side, t) for side in sides for t in sorted(known)
+            if lperms is None or t in lperms]
+
+def compute_left(path):
+    return compute_hess(path, ('left',))['left']
+
+def compute_right(path):
+    return compute_hess(path, ('right',))['right']
 
 def check_rreg(path):
     r"""
@@ -272,6 +1642,138 @@ def check_rreg(path):
 
 # ---------------------------------------------------------
 
+def test_indices(below=7):
+    r"""
+    Test that `offset_ranks` agrees with checking every offset of every
+    bfact, for the cubes above and below.
+
+    >>> test_indices()
+    """
+    for n in range(1, below):
+        maxoff = (0,) + (1,)*(n-1)
+        offsets = list(it.product(*([(0,)] + [(0, 1)]*(n-1))))
+        above = offset_ranks(n, size_shift(n, 'above'))
+        below = offset_ranks(n, size_shift(n, 'below'))
+        for r, bfact in enumerate(iter_bfact(n)):
+            for o, offset in enumerate(offsets):
+                ofact = tuple(b+oo for b, oo in zip(bfact, offset))
+                assert above[r, o] == (
+                    rank_from_bfact(ofact) if is_bfact(ofact) else -1)
+                ofact = tuple(b+oo-m for b, oo, m in zip(bfact, offset, maxoff))
+                assert below[r, o] == (
+                    rank_from_bfact(ofact) if is_bfact(ofact) else -1)
+
+def test_flowup(below=5):
+    r"""
+    Test that the flowup fragments are fragments for their paths.
+    """
+    for n in range(1, below):
+        for path in iter_path(n):
+            for bfact in iter_bfact(n):
+                assert is_fragment(flowup_fragment(bfact, path), path)
+
+def test_invalid_fragments(below=5):
+    r"""
+    Test that `invalid_fragments` agrees with `is_fragment` on the
+    flowup fragments, and on copies of them with some coordinates
+    dropped or with root products moved to other coordinates.
+    """
+    for n in range(1, below):
+        for path in iter_path(n):
+            flowups = [flowup(bfact, path) for bfact in iter_bfact(n)]
+            for variant in range(3):
+                if variant == 1:
+                    flowups = [Flowup(*[x[::2] for x in f]) for f in flowups]
+                elif variant == 2:
+                    flowups = [
+                        Flowup(f.ranks, *[np.roll(x, 1, axis=0)
+                                          for x in f[1:]])
+                        for f in flowups]
+                expected = [
+                    k for k, f in enumerate(flowups)
+                    if not is_fragment({
+                        blist_from_rank(int(rank), n):
+                            normalize_root_product(zip(lows, ups))
+                        for rank, lows, ups in zip(*f)
+                        }, path)]
+                actual = invalid_fragments(fragment_table(flowups, n), path)
+                assert actual.tolist() == expected, (path, variant)
+
+def test_prefix_roots(below=6):
+    r"""
+    Test that `prefix_roots` agrees with `rpspec`, for all Dyck paths
+    and their prefixes.
+    """
+    for n in range(1, below):
+        for path in iter_path(n):
+            roots = prefix_roots(path)
+            for r, bfact in enumerate(iter_bfact(n)):
+                mobile, fixed = rpspec(bfact, path)
+                expected = (
+                    sorted(i*(i+1)//2 + jj for jj, i in mobile),
+                    sorted(root_index(v, i) for v, i in fixed))
+                actual = (
+                    np.nonzero(roots.mobile[r])[0].tolist(),
+                    np.nonzero(roots.fixed[r])[0].tolist())
+                assert actual == expected, (path, bfact)
+
+def test_modular(below=6):
+    r"""
+    Test that `compute_hess_modular` agrees with `compute_hess`.
+    """
+    for n in range(1, below):
+        for path in iter_path(n):
+            assert compute_hess_modular(path) == compute_hess(path)
+
+def test_overflow(path=(0, 0, 0, 1), limit=4):
+    r"""
+    Test that `compute_hess` and `compute_hess_modular` still agree
+    with `compute_hess` in core when they work out of core and the
+    bases do not fit in int64, by lowering `native_limit` to `limit`.
+    """
+    global native_limit
+    expected = compute_hess(path)
+    root = tempfile.mkdtemp()
+    saved, native_limit = native_limit, limit
+    try:
+        assert compute_hess(path, store=root, block=5) == expected
+        assert compute_hess_modular(path, store=root, block=5) == expected
+        assert compute_hess(path, store=root, block=5) == expected
+    finally:
+        native_limit = saved
+        shutil.rmtree(root)
+
+def test_valuations(below=5):
+    r"""
+    Test that `valued_array` agrees with `lvaluated_fragment` and
+    `rvaluated_fragment` on translated flowup fragments.
+
+    >>> test_valuations()
+    """
+    for n in range(1, below):
+        bfacts = list(iter_bfact(n))
+        blists = map(blist_from_bfact, bfacts)
+        positions = np.argsort(blists_from_bfacts(bfacts), axis=1)
+        coords = sparse_cubes(np.array([range(len(blists))] * len(bfacts)))
+        for path in iter_path(n):
+            frags = [flowup_fragment(bfact, path) for bfact in bfacts]
+            table = fragment_table(
+                [flowup(bfact, path) for bfact in bfacts], n)
+            for t in translators(n):
+                moved = translation_table(t)
+                for side, valued in [('left', lvaluated_fragment),
+                                     ('right', rvaluated_fragment)]:
+                    actual = valued_array(
+                        table, moved, coords, positions, valuations[side])
+                    actual = actual.values.reshape(len(bfacts), -1)
+                    for k, frag in enumerate(frags):
+                        expected = valued(translated_fragment(t, frag))
+                        assert all(
+                            actual[k, r] == expected.get(bl, 0)
+                            for r, bl in enumerate(blists))
+
+# ---------------------------------------------------------
+
 #check translation classes?
 #test vector supports?
 
@@ -290,21 +1792,157 @@ def setup_logging():
             '%(module)s (elapsed time %(relativeCreated)d): %(message)s'))
     logger.addHandler(handler)
 
+def resident_memory():
+    r"""
+    Return the current and peak resident memory of this process in
+    bytes, or None for the current one where /proc is not available.
+    """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except IOError:
+        return None, peak
+    return pages * resource.getpagesize(), peak
+
 # ---------------------------------------------------------
 
 def argparse():
     import argparse
     parser = argparse.ArgumentParser(
-        description='Compute left and right Hessenberg characters for a given Dyck path.',
+        description='Compute left and right Hessenberg characters for the given Dyck paths, '
+                    'in a single process.',
+        )
+    parser.add_argument(
+        'paths',
+        nargs='*',
+        metavar='path',
+        help='A Dyck path (e.g. triangle is 000, fully disconnected is 012).',
+        )
+    parser.add_argument(
+        '--size',
+        type=int,
+        action='append',
+        default=[],
+        metavar='n',
+        help='Also compute for the Dyck paths of size n. This may be '
+             'repeated: the paths of all sizes are then taken in the '
+             'order of their prefixes, so that they share their work.',
+        )
+    parser.add_argument(
+        '--ranks',
+        metavar='START:STOP',
+        help='Only use the Dyck paths of each size n with ranks in this '
+             'range, in the order of iter_path.',
+        )
+    parser.add_argument(
+        '--stdin',
+        action='store_true',
+        help='Also read Dyck paths from standard input, one per line.',
+        )
+    parser.add_argument(
+        '--store',
+        metavar='DIR',
+        help='Keep the flowup tables and bases in DIR between runs '
+             '(e.g. var/flowup).',
+        )
+    parser.add_argument(
+        '--validate',
+        action='store_true',
+        help='Check that the flowup fragments are valid for their paths '
+             '(see invalid_fragments).',
+        )
+    parser.add_argument(
+        '--modular',
+        action='store_true',
+        help='Run the elimination modulo several primes '
+             '(see compute_hess_modular).',
+        )
+    parser.add_argument(
+        '--primes',
+        metavar='K',
+        type=int,
+        help='With --modular, reconstruct from K primes instead of '
+             'enough for the default bound, plus one to check.',
+        )
+    parser.add_argument(
+        '--jobs',
+        metavar='J',
+        type=int,
+        default=1,
+        help='With --modular, run the primes in J processes.',
+        )
+    parser.add_argument(
+        '--out-of-core',
+        action='store_true',
+        help='Keep the flowup tables and bases in memory-mapped files '
+             'in the --store directory (by default var/flowup), and '
+             'solve in blocks of bfacts.',
+        )
+    parser.add_argument(
+        '--block',
+        metavar='ROWS',
+        type=int,
+        default=1 << 14,
+        help='With --out-of-core, solve ROWS bfacts at a time '
+             '(default %(default)s).',
         )
     parser.add_argument(
-        'path',
-        help='The Dyck path (e.g. triangle is 000, fully disconnected is 012).',
+        '--side',
+        action='append',
+        choices=['left', 'right'],
+        help='Only compute this side, as partial results in the '
+             '--partials directory. This may be repeated.',
+        )
+    parser.add_argument(
+        '--translator',
+        action='append',
+        metavar='LPERM',
+        help='Only compute for this translator (e.g. 201), as partial '
+             'results in the --partials directory. This may be repeated.',
+        )
+    parser.add_argument(
+        '--partials',
+        metavar='DIR',
+        default='var/partial',
+        help='Keep the partial results in DIR (default %(default)s). '
+             'Those which are already there are not computed again.',
+        )
+    parser.add_argument(
+        '--merge',
+        action='store_true',
+        help='Instead of computing, assemble the partial results of the '
+             'paths into their output files.',
+        )
+    parser.add_argument(
+        '--doctest',
+        action='store_true',
+        help='Run the doctests for this module first.',
         )
     args = parser.parse_args()
-    path = tuple(map(int, args.path))
-    assert is_path(path)
-    return path
+    if args.translator is not None:
+        args.translator = [tuple(map(int, t)) for t in args.translator]
+    if args.out_of_core:
+        args.store = args.store or 'var/flowup'
+    else:
+        args.block = None
+    paths = [tuple(map(int, path)) for path in args.paths]
+    if args.size:
+        keep_sizes(len(set(args.size)))
+        start, stop = 0, None
+        if args.ranks is not None:
+            start, stop = [int(r) if r else None for r in args.ranks.split(':')]
+        for path in iter_path_tree(args.size):
+            rank = rank_from_path(path)
+            if (start or 0) <= rank and (stop is None or rank < stop):
+                paths.append(path)
+    if args.stdin:
+        paths = it.chain(paths, (
+            tuple(map(int, line.strip()))
+            for line in iter(sys.stdin.readline, '')
+            if line.strip()))
+    return paths, args
 
 # ---------------------------------------------------------
 
@@ -348,18 +1986,124 @@ def save(path, left, right):
                 f.write("    ({}, {}),\n".format(list(index), coeffs))
         f.write(right_output_footer)
 
+def partial_file(directory, path, side, lperm):
+    r"""
+    Return the name of the file in `directory` holding the partial
+    result of `path` for `side` and `lperm`.
+
+    >>> partial_file('var/partial', (0, 0, 1), 'left', (1, 0, 2))
+    'var/partial/001/left-102.json'
+    """
+    return os.path.join(directory, ''.join(map(str, path)), '%s-%s.json' % (
+        side, ''.join(map(str, lperm))))
+
+def save_partial(directory, path, side, lperm, csf):
+    r"""
+    Write the coefficients `csf[lperm, deg]` of `path` for `side` to
+    their `partial_file` in `directory`. The file is written under a
+    temporary name and then renamed, so that jobs on several machines
+    can share `directory`.
+
+    >>> root = tempfile.mkdtemp()
+    >>> path = (0, 0, 1)
+    >>> for side, t in work_units(path):
+    ...     csf = compute_hess(path, (side,), lperms=[t])[side]
+    ...     save_partial(root, path, side, t, csf)
+    >>> merge_partials(root, path) == compute_hess(path)
+    True
+    >>> os.remove(partial_file(root, path, 'right', (2, 0, 1)))
+    >>> merge_partials(root, path)
+    Traceback (most recent call last):
+    ...
+    ValueError: path (0, 0, 1): missing partial results for [('right', (2, 0, 1))]
+    >>> shutil.rmtree(root)
+    """
+    filename = partial_file(directory, path, side, lperm)
+    parent = os.path.dirname(filename)
+    try:
+        os.makedirs(parent)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    coeffs = sorted(
+        (deg, coeff) for (t, deg), coeff in csf.iteritems() if t == lperm)
+    fd, tmp = tempfile.mkstemp(dir=parent, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'path': list(path), 'side': side, 'lperm': list(lperm),
+                   'coeffs': coeffs}, f)
+    os.rename(tmp, filename)
+
+def merge_partials(directory, path):
+    r"""
+    Gather the partial results of `path` in `directory` for all its
+    `work_units`, and return them in the same form as `compute_hess`.
+    Raise a ValueError if some of them are missing.
+    """
+    hess = {side: {} for side in ('left', 'right')}
+    missing = []
+    for side, t in work_units(path):
+        try:
+            with open(partial_file(directory, path, side, t)) as f:
+                partial = json.load(f)
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            missing.append((side, t))
+            continue
+        for deg, coeff in partial['coeffs']:
+            hess[side][t, deg] = coeff
+    if missing:
+        raise ValueError('path %s: missing partial results for %s' % (
+            path, missing))
+    return hess
+
 # ---------------------------------------------------------
 
 if __name__ == '__main__':
-    doctest()
+    paths, args = argparse()
+    if args.doctest:
+        doctest()
     setup_logging()
-    path = argparse()
-    logger.info('starting left computation for path %s', path)
-    left = compute_left(path)
-    logger.info('starting right computation for path %s', path)
-    right = compute_right(path)
-    save(path, left, right)
-    logger.info('done with path %s', path)
+    primes = args.primes and word_primes(args.primes + 1)
+    def compute(path, sides=('left', 'right'), lperms=None):
+        if args.modular:
+            return compute_hess_modular(
+                path, sides, primes, args.store, args.validate, args.jobs,
+                args.block, lperms)
+        return compute_hess(
+            path, sides, args.store, args.validate, args.block, lperms)
+    for path in paths:
+        assert is_path(path)
+        if args.merge:
+            hess = merge_partials(args.partials, path)
+            save(path, hess['left'], hess['right'])
+            logger.info('merged the partial results for path %s', path)
+            continue
+        logger.info('starting computation for path %s', path)
+        if args.side or args.translator:
+            units = [
+                (side, t) for side, t in work_units(
+                    path, args.side or ('left', 'right'), args.translator)
+                if not os.path.exists(
+                    partial_file(args.partials, path, side, t))]
+            for side in sorted(set(side for side, t in units)):
+                lperms = [t for s, t in units if s == side]
+                csf = compute(path, (side,), lperms)[side]
+                for t in lperms:
+                    save_partial(args.partials, path, side, t, csf)
+            logger.info('computed the partial results %s for path %s',
+                        units, path)
+        else:
+            hess = compute(path)
+            save(path, hess['left'], hess['right'])
+        forget_path(path)
+        forget_prefixes(path)
+        logger.info('done with path %s', path)
+        current, peak = resident_memory()
+        logger.info('resident memory %s MB, peak %d MB',
+                    current and current >> 20, peak >> 20)
+    for line in memo_stats():
+        logger.info('cache %s', line)
 
 # ---------------------------------------------------------
 
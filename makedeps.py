@@ -43,9 +43,8 @@ def argparse():
     parser.add_argument(
         'n',
         type=int,
-        choices=range(1, 11),
         metavar='n',
-        help='The size of Dyck path to consider (from 1 to 10).',
+        help='The size of Dyck path to consider.',
         )
     args = parser.parse_args()
     return args.n
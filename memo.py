@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+r"""
+Memoisation with bounded caches.
+
+Each memoised function keeps its results in a least-recently-used
+cache, which can be bounded by a number of entries and/or an estimate
+of its size in bytes, and counts its hits, misses and evictions.
+All memoised functions are registered, so that their statistics can be
+reported, and so that the entries for a finished path can be dropped.
+
+To run some tests for this module, use the command:
+$ python memo.py
+For more verbose output, use:
+$ python memo.py -v
+
+"""
+
+__all__ = [
+    'forget_path',
+    'memoize',
+    'memo_stats',
+    'sizeof',
+    ]
+
+# ---------------------------------------------------------
+
+import sys
+from collections import OrderedDict
+
+# ---------------------------------------------------------
+
+_registry = []
+
+class Memo(object):
+    r"""
+    A memoised function with a bounded LRU cache.
+
+    `maxsize` bounds the number of entries and `maxbytes` bounds the
+    total of `sizer(key, value)` over all entries; either may be None.
+    If `path_arg` is not None, argument number `path_arg` of the
+    function is a Dyck path, and `forget_path` drops the entries for it.
+
+    >>> calls = []
+    >>> square = Memo(lambda x: calls.append(x) or x*x, 'square', maxsize=2)
+    >>> [square(2), square(3), square(2), square(4), square(3)]
+    [4, 9, 4, 16, 9]
+    >>> calls
+    [2, 3, 4, 3]
+    >>> square.stats()
+    'square: 2 entries, 0 bytes, 1 hits, 4 misses, 2 evictions'
+    """
+    def __init__(self, function, name, maxsize=None, maxbytes=None,
+                 sizer=None, path_arg=None):
+        self.function = function
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        if sizer is None and maxbytes is not None:
+            sizer = sizeof
+        self.sizer = sizer
+        self.path_arg = path_arg
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.__doc__ = function.__doc__
+
+    def __call__(self, *args):
+        try:
+            value = self.data.pop(args)
+        except KeyError:
+            self.misses += 1
+            value = self.function(*args)
+            self.store(args, value)
+        else:
+            self.hits += 1
+            self.data[args] = value
+        return value
+
+    def store(self, key, value):
+        self.data[key] = value
+        if self.sizer is not None:
+            self.sizes[key] = self.sizer(key, value)
+            self.bytes += self.sizes[key]
+        while self.data and (
+                (self.maxsize is not None and
+                 len(self.data) > self.maxsize) or
+                (self.maxbytes is not None and
+                 self.bytes > self.maxbytes)):
+            self.drop(next(iter(self.data)))
+            self.evictions += 1
+
+    def drop(self, key):
+        del self.data[key]
+        self.bytes -= self.sizes.pop(key, 0)
+
+    def discard(self, predicate):
+        r"""
+        Drop the entries whose argument tuple satisfies `predicate`.
+        These are not counted as evictions.
+        """
+        for key in [key for key in self.data if predicate(key)]:
+            self.drop(key)
+
+    def clear(self):
+        self.discard(lambda key: True)
+
+    def stats(self):
+        return '%s: %d entries, %d bytes, %d hits, %d misses, %d evictions' % (
+            self.name, len(self.data), self.bytes,
+            self.hits, self.misses, self.evictions)
+
+def memoize(name, maxsize=None, maxbytes=None, sizer=None, path_arg=None):
+    r"""
+    Decorator turning a function into a registered `Memo`.
+
+    >>> @memoize('double', maxsize=10)
+    ... def double(x):
+    ...     return 2*x
+    >>> double(3), double(3)
+    (6, 6)
+    >>> double.stats()
+    'double: 1 entries, 0 bytes, 1 hits, 1 misses, 0 evictions'
+    >>> _registry.remove(double)
+    """
+    def decorator(function):
+        result = Memo(function, name, maxsize, maxbytes, sizer, path_arg)
+        _registry.append(result)
+        return result
+    return decorator
+
+def forget_path(path):
+    r"""
+    Drop the entries for the Dyck path `path` from all registered caches
+    which take a path argument.
+    """
+    for memo in _registry:
+        if memo.path_arg is not None:
+            memo.discard(lambda key: key[memo.path_arg] == path)
+
+def memo_stats():
+    r"""
+    Return a list of lines describing the registered caches.
+    """
+    return [memo.stats() for memo in _registry]
+
+def sizeof(key, value):
+    r"""
+    Estimate the memory used by a cache entry, following tuples, lists
+    and dicts, and counting the buffers of NumPy arrays (which
+    `sys.getsizeof` already includes for arrays owning their data).
+
+    >>> sizeof((), ()) == 2 * sys.getsizeof(())
+    True
+    """
+    return _deep_sizeof(key) + _deep_sizeof(value)
+
+def _deep_sizeof(obj):
+    result = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        result += sum(_deep_sizeof(item) for item in obj)
+    elif isinstance(obj, dict):
+        result += sum(_deep_sizeof(k) + _deep_sizeof(v)
+                      for k, v in obj.iteritems())
+    elif hasattr(obj, 'nbytes') and getattr(obj, 'base', None) is not None:
+        result += obj.nbytes
+    return result
+
+# ---------------------------------------------------------
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+# ---------------------------------------------------------
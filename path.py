@@ -29,6 +29,9 @@ each downward row. For example, the following Dyck paths:
 /\/\/\
 (0, 1, 2)
 
+Dyck paths of length n are also numbered from 0 to C_n - 1 by their
+rank, which is their position in `iter_path(n)`.
+
 
 To run some tests for this module, use the command:
 $ python path.py
@@ -38,14 +41,24 @@ $ python path.py -v
 """
 
 __all__ = [
+    'boxes_bitmasks',
+    'boxes_matrices',
+    'boxes_matrix',
     'boxes_under_path',
     'is_path',
     'iter_path',
+    'iter_path_tree',
+    'path_from_rank',
+    'paths_array',
+    'rank_from_path',
     ]
 
 # ---------------------------------------------------------
 
 import itertools as it
+import numpy as np
+
+from memo import *
 
 # ---------------------------------------------------------
 
@@ -88,14 +101,28 @@ def iter_path(n):
             for tail in range(head[-1], n):
                 yield head + (tail,)
 
-_boxes_cache = {}
-def boxes_under_path(p):
-    try:
-        return _boxes_cache[p]
-    except KeyError:
-        result = _boxes_compute(p)
-        _boxes_cache[p] = result
-        return result
+def iter_path_tree(sizes):
+    r"""
+    Return an iterator over all valid Dyck paths whose lengths are in
+    `sizes`, in depth-first order of the tree of their prefixes: the
+    paths of each length come in the order of `iter_path`, and each
+    path comes right before the longer paths which extend it.
+
+    >>> list(iter_path_tree([2, 3]))
+    [(0, 0), (0, 0, 0), (0, 0, 1), (0, 0, 2), (0, 1), (0, 1, 1), (0, 1, 2)]
+    """
+    sizes = set(sizes)
+    if not sizes:
+        return
+    stack = [()]
+    while stack:
+        head = stack.pop()
+        if len(head) in sizes:
+            yield head
+        if len(head) < max(sizes):
+            tails = range(head[-1], len(head) + 1) if head else [0]
+            stack.extend(head + (tail,) for tail in reversed(tails))
+
 def _boxes_compute(p):
     r"""
     Return the set of boxes `(i, j)` below the path `p`.
@@ -113,6 +140,123 @@ def _boxes_compute(p):
     """
     return {(i, j) for j, k in enumerate(p) for i in range(k, j)}
 
+boxes_under_path = memoize(
+    'boxes_under_path', maxsize=1 << 16, path_arg=0,
+    )(_boxes_compute)
+
+def boxes_bitmasks(p):
+    r"""
+    Return the boxes below the path `p` as a tuple of bitmasks,
+    where bit `j` of entry `i` is set if `(i, j)` is below `p`.
+
+    >>> boxes_bitmasks((0, 0, 0))
+    (6, 4, 0)
+    >>> boxes_bitmasks((0, 0, 1))
+    (2, 4, 0)
+    """
+    result = [0] * len(p)
+    for j, k in enumerate(p):
+        for i in range(k, j):
+            result[i] |= 1 << j
+    return tuple(result)
+
+def boxes_matrix(p):
+    r"""
+    Return the boxes below the path `p` as a boolean matrix,
+    where entry `(i, j)` is set if `(i, j)` is below `p`.
+
+    >>> boxes_matrix((0, 0, 1))
+    array([[False,  True, False],
+           [False, False,  True],
+           [False, False, False]])
+    """
+    return boxes_matrices(np.array([p], dtype=int).reshape(1, len(p)))[0]
+
+def boxes_matrices(ps):
+    r"""
+    Return the boolean matrices `boxes_matrix(p)` for each path `p`
+    in the array of paths `ps`, with one path per row.
+
+    >>> boxes_matrices(paths_array(2))
+    array([[[False,  True],
+            [False, False]],
+    <BLANKLINE>
+           [[False, False],
+            [False, False]]])
+    """
+    ps = np.asarray(ps)
+    n = ps.shape[-1]
+    rows = np.arange(n)[:, None]
+    columns = np.arange(n)[None, :]
+    return (ps[..., None, :] <= rows) & (rows < columns)
+
+# ---------------------------------------------------------
+
+def _counts_compute(n):
+    r"""
+    Return the table of the numbers of ways `counts[k][v]` to complete
+    a prefix of length `k` ending with `v` into a Dyck path of length `n`.
+    """
+    counts = [None] * n + [[1] * n]
+    for k in range(n-1, 0, -1):
+        counts[k] = [sum(counts[k+1][v:k+1]) for v in range(n)]
+    return counts
+
+_counts = memoize('path_counts', maxsize=16)(_counts_compute)
+
+def rank_from_path(p):
+    r"""
+    Return the rank of the Dyck path `p`.
+
+    >>> [rank_from_path(p) for p in iter_path(3)]
+    [0, 1, 2, 3, 4]
+    """
+    counts = _counts(len(p))
+    return sum(
+        sum(counts[k+1][p[k-1]:p[k]])
+        for k in range(1, len(p))
+        )
+
+def path_from_rank(rank, n):
+    r"""
+    Return the Dyck path of length `n` with the given rank.
+
+    >>> [path_from_rank(r, 3) for r in range(5)] == list(iter_path(3))
+    True
+    """
+    counts = _counts(n)
+    result = [0] if n else []
+    for k in range(1, n):
+        v = result[-1]
+        while rank >= counts[k+1][v]:
+            rank -= counts[k+1][v]
+            v += 1
+        result.append(v)
+    assert rank == 0
+    return tuple(result)
+
+def paths_array(n):
+    r"""
+    Return the array of all Dyck paths of length `n` in rank order,
+    with one path per row.
+
+    >>> paths_array(3)
+    array([[0, 0, 0],
+           [0, 0, 1],
+           [0, 0, 2],
+           [0, 1, 1],
+           [0, 1, 2]], dtype=int8)
+    """
+    result = np.zeros((1, min(n, 1)), dtype=np.int8)
+    for k in range(1, n):
+        last = result[:, -1].astype(int)
+        sizes = k + 1 - last
+        starts = np.cumsum(sizes) - sizes
+        tails = np.arange(sizes.sum()) - np.repeat(starts - last, sizes)
+        result = np.column_stack([np.repeat(result, sizes, axis=0),
+                                  tails.astype(np.int8)])
+    return result
+
 # ---------------------------------------------------------
 
 def test_is_path(below=7):
@@ -126,6 +270,29 @@ def test_is_path(below=7):
         actual = filter(is_path, it.product(range(n), repeat=n))
         assert expected == actual
 
+def test_rank(below=9):
+    r"""
+    Test that ranks and `paths_array` follow the order of `iter_path`,
+    and that the bitmask and matrix forms of the boxes below a path
+    agree with `boxes_under_path`.
+
+    >>> test_rank()
+    """
+    for n in range(below):
+        paths = list(iter_path(n))
+        assert map(tuple, paths_array(n).tolist()) == paths
+        matrices = boxes_matrices(paths_array(n))
+        for r, p in enumerate(paths):
+            assert rank_from_path(p) == r
+            assert path_from_rank(r, n) == p
+            boxes = boxes_under_path(p)
+            assert {
+                (i, j) for i, mask in enumerate(boxes_bitmasks(p))
+                for j in range(n) if mask >> j & 1
+                } == boxes
+            assert set(zip(*np.nonzero(matrices[r]))) == boxes
+            assert (boxes_matrix(p) == matrices[r]).all()
+
 # ---------------------------------------------------------
 if __name__ == '__main__':
     import doctest
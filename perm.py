@@ -9,6 +9,14 @@ There are two useful representations:
  - blist: tuple of images
  - bfact: the code of a permutation
 
+Permutations of size n are also numbered from 0 to n!-1 by their rank,
+which is the integer with factorial base digits `bfact`, so that
+`iter_bfact(n)` goes through them in rank order. Note that
+`iter_blist(n)` does not: it goes through the blists in lexicographic
+order.
+The functions with plural names convert whole arrays of permutations
+at once, with one permutation per row.
+
 To run some tests for this module, use the command:
 $ python perm.py
 For more verbose output, use:
@@ -18,16 +26,27 @@ $ python perm.py -v
 
 __all__ = [
     'bfact_from_blist',
+    'bfact_from_rank',
+    'bfacts_from_blists',
+    'bfacts_from_ranks',
     'blist_from_bfact',
+    'blist_from_rank',
+    'blists_from_bfacts',
     'is_bfact',
     'is_blist',
     'iter_bfact',
     'iter_blist',
+    'rank_from_bfact',
+    'rank_from_blist',
+    'ranks_from_bfacts',
+    'ranks_from_blists',
     ]
 
 # ---------------------------------------------------------
 
 import itertools as it
+import numpy as np
+from math import factorial
 
 # ---------------------------------------------------------
 
@@ -112,6 +131,129 @@ def blist_from_bfact(bf):
 
 # ---------------------------------------------------------
 
+def rank_from_bfact(bf):
+    r"""
+    Return the rank of a bfact.
+
+    >>> [rank_from_bfact(bf) for bf in iter_bfact(3)]
+    [0, 1, 2, 3, 4, 5]
+    """
+    result = 0
+    for i, digit in enumerate(bf):
+        result = result * (i+1) + digit
+    return result
+
+def bfact_from_rank(rank, n):
+    r"""
+    Return the bfact of length `n` with the given rank.
+
+    >>> [bfact_from_rank(r, 3) for r in range(6)] == list(iter_bfact(3))
+    True
+    """
+    result = []
+    for i in range(n, 0, -1):
+        rank, digit = divmod(rank, i)
+        result.append(digit)
+    assert rank == 0
+    return tuple(reversed(result))
+
+def rank_from_blist(bl):
+    r"""
+    Return the rank of a blist.
+
+    >>> [rank_from_blist(bl) for bl in iter_blist(3)]
+    [0, 1, 3, 4, 2, 5]
+    """
+    return rank_from_bfact(bfact_from_blist(bl))
+
+def blist_from_rank(rank, n):
+    r"""
+    Return the blist of length `n` with the given rank.
+
+    >>> [blist_from_rank(r, 3) for r in range(6)]
+    [(0, 1, 2), (0, 2, 1), (2, 0, 1), (1, 0, 2), (1, 2, 0), (2, 1, 0)]
+    """
+    return blist_from_bfact(bfact_from_rank(rank, n))
+
+def ranks_from_bfacts(bfs):
+    r"""
+    Return the array of ranks of an array of bfacts.
+
+    >>> ranks_from_bfacts(np.array([[0, 0, 2], [0, 1, 2]]))
+    array([2, 5])
+    """
+    bfs = np.asarray(bfs)
+    n = bfs.shape[-1]
+    weights = [factorial(n) // factorial(i+1) for i in range(n)]
+    return np.dot(bfs, np.array(weights, dtype=int))
+
+def bfacts_from_ranks(n, ranks=None):
+    r"""
+    Return the array of bfacts of length `n` with the given ranks,
+    which default to all ranks in order.
+
+    >>> bfacts_from_ranks(3)
+    array([[0, 0, 0],
+           [0, 0, 1],
+           [0, 0, 2],
+           [0, 1, 0],
+           [0, 1, 1],
+           [0, 1, 2]], dtype=int8)
+    """
+    if ranks is None:
+        ranks = np.arange(factorial(n))
+    ranks = np.array(ranks, dtype=int)
+    result = np.zeros(ranks.shape + (n,), dtype=np.int8)
+    for i in range(n, 0, -1):
+        ranks, result[..., i-1] = np.divmod(ranks, i)
+    return result
+
+def blists_from_bfacts(bfs):
+    r"""
+    Convert an array of bfacts into an array of blists.
+
+    >>> blists_from_bfacts(np.array([[0, 0, 0, 0, 0], [0, 1, 2, 3, 4]]))
+    array([[0, 1, 2, 3, 4],
+           [4, 3, 2, 1, 0]], dtype=int8)
+    """
+    bfs = np.asarray(bfs)
+    n = bfs.shape[-1]
+    result = np.zeros(bfs.shape, dtype=np.int8)
+    columns = np.arange(n)
+    for i in range(n):
+        where = (i - bfs[..., i])[..., None]
+        shifted = np.roll(result, 1, axis=-1)
+        result = np.where(columns < where, result,
+                          np.where(columns == where, i, shifted))
+    return result.astype(np.int8)
+
+def bfacts_from_blists(bls):
+    r"""
+    Convert an array of blists into an array of bfacts.
+
+    >>> bfacts_from_blists(np.array([[0, 1, 2, 3, 4], [1, 0, 2, 3, 4]]))
+    array([[0, 0, 0, 0, 0],
+           [0, 1, 0, 0, 0]], dtype=int8)
+    """
+    positions = np.argsort(np.asarray(bls), axis=-1)
+    n = positions.shape[-1]
+    result = np.zeros(positions.shape, dtype=np.int8)
+    for i in range(n):
+        for j in range(i):
+            result[..., i] += positions[..., j] > positions[..., i]
+    return result
+
+def ranks_from_blists(bls):
+    r"""
+    Return the array of ranks of an array of blists.
+
+    >>> ranks_from_blists(np.array(list(iter_blist(3))))
+    array([0, 1, 3, 4, 2, 5])
+    """
+    return ranks_from_bfacts(bfacts_from_blists(bls))
+
+# ---------------------------------------------------------
+
 def test_is_blist(below=7):
     r"""
     Test that `is_blist` corresponds to `iter_blist`.
@@ -164,6 +306,28 @@ def test_truncate(below=7):
             bl2 = tuple(bl2)
             assert bl1 == bl2
 
+def test_rank(below=7):
+    r"""
+    Test that ranks follow the order of `iter_bfact`, and that the
+    array conversions agree with the conversions of single permutations.
+
+    >>> test_rank()
+    """
+    for n in range(1, below):
+        bfs = list(iter_bfact(n))
+        bls = map(blist_from_bfact, bfs)
+        for r, (bf, bl) in enumerate(zip(bfs, bls)):
+            assert rank_from_bfact(bf) == rank_from_blist(bl) == r
+            assert bfact_from_rank(r, n) == bf
+            assert blist_from_rank(r, n) == bl
+        bf_array = bfacts_from_ranks(n)
+        bl_array = blists_from_bfacts(bf_array)
+        assert map(tuple, bf_array.tolist()) == bfs
+        assert map(tuple, bl_array.tolist()) == bls
+        assert (bfacts_from_blists(bl_array) == bf_array).all()
+        assert (ranks_from_blists(bl_array) == np.arange(len(bfs))).all()
+        assert (ranks_from_bfacts(bf_array) == np.arange(len(bfs))).all()
+
 # ---------------------------------------------------------
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,524 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+r"""
+Driver for running all the computations of the Makefile in a pool of
+worker processes.
+
+The work is made of one `csf.py` job per size and one `hess.py` job per
+Dyck path, and the paths which are expected to take long can be split
+further into the work units of `hess.work_units`, whose partial results
+are merged once they are all done. The jobs are run longest first,
+according to `estimate`, which uses the timings recorded by previous
+runs.
+
+A job whose outputs are newer than all the source files, as Make would
+decide, is not run again, so that an interrupted run resumes where it
+stopped. The outputs of the jobs are also kept in a cache, under the
+`result_hash` of the functions which compute them (see `digests`). A
+job whose outputs are in the cache is not run again either: they are
+only copied back, so that editing code which does not take part in a
+computation does not redo it.
+
+To run some tests for this module, use the command:
+$ python schedule.py --doctest
+"""
+
+__all__ = [
+    'Job',
+    'estimate',
+    'plan',
+    'prior_cost',
+    'digests',
+    ]
+
+# ---------------------------------------------------------
+
+import datetime
+import errno
+import json
+import multiprocessing
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from math import factorial
+
+import csf
+import hess
+from hess import partial_file, work_units
+from path import *
+from store import *
+
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# ---------------------------------------------------------
+
+SOURCES = [
+    'csf.py', 'fragment.py', 'hess.py', 'makedeps.py', 'memo.py',
+    'path.py', 'perm.py', 'schedule.py', 'store.py', 'util.py',
+    ]
+
+# A job runs the argument list `command`, which writes the files in
+# `outputs`, and then touches the file `stamp` unless it is None. Its
+# `kind`, the `size` of its paths, the number of `boxes` under its path
+# and the number of `units` its path is split into give its cost.
+Job = namedtuple('Job', 'key kind size boxes units command outputs stamp')
+
+def digests():
+    r"""
+    Return a dict mapping each kind of job to the `result_hash` of the
+    functions which compute its outputs. The command line flags of the
+    jobs are assumed not to change their outputs.
+
+    >>> sorted(digests())
+    ['csf', 'hess']
+    """
+    return {
+        'csf': result_hash(csf.save_csfs),
+        'hess': result_hash(
+            hess.compute_hess, hess.compute_hess_modular, hess.save,
+            hess.save_partial, hess.merge_partials),
+        }
+
+def csf_job(n, flags=()):
+    r"""
+    Return the `Job` computing the chromatic symmetric functions of
+    size `n`, with the extra command line `flags` for `csf.py`.
+
+    >>> csf_job(2).command, csf_job(2).outputs
+    (['python', 'csf.py', '2'], ['output/csf-00.py', 'output/csf-01.py'])
+    """
+    outputs = [
+        'output/csf-%s.py' % ''.join(map(str, path))
+        for path in iter_path(n)]
+    return Job('csf-%d' % n, 'csf', n, 0, 1,
+               ['python', 'csf.py'] + list(flags) + [str(n)],
+               outputs, 'var/csf-size-%d' % n)
+
+def hess_jobs(path, flags=(), partials=None):
+    r"""
+    Return the list of `Job` computing the Hessenberg characters of
+    `path`, with the extra command line `flags` for `hess.py`: a single
+    one if `partials` is None, and one for each of its `work_units`
+    otherwise, with their partial results in the directory `partials`.
+
+    >>> [job.key for job in hess_jobs((0, 0))]
+    ['hess-00']
+    >>> units = hess_jobs((0, 0), (), 'var/partial')
+    >>> [job.key[len('hess-00-'):] for job in units]
+    ['left-01', 'left-10', 'right-01', 'right-10']
+    >>> ' '.join(units[0].command)
+    'python hess.py --partials var/partial --side left --translator 01 00'
+    """
+    name = ''.join(map(str, path))
+    boxes = len(boxes_under_path(path))
+    if partials is None:
+        return [Job('hess-' + name, 'hess', len(path), boxes, 1,
+                    ['python', 'hess.py'] + list(flags) + [name],
+                    ['output/hess-%s.py' % name], None)]
+    units = work_units(path)
+    return [
+        Job('hess-%s-%s-%s' % (name, side, ''.join(map(str, t))), 'hess',
+            len(path), boxes, len(units),
+            ['python', 'hess.py'] + list(flags) + [
+                '--partials', partials, '--side', side,
+                '--translator', ''.join(map(str, t)), name],
+            [partial_file(partials, path, side, t)], None)
+        for side, t in units]
+
+def prior_cost(job):
+    r"""
+    Return a rough estimate of the time taken by `job` in seconds,
+    before any timing was recorded: the elimination in `hess.py` goes
+    through ``n! 2^(n-1)`` coordinates, each with more work when there
+    are more boxes under the path.
+
+    >>> full, empty = hess_jobs((0, 0, 0)), hess_jobs((0, 1, 2))
+    >>> prior_cost(full[0]) > prior_cost(empty[0])
+    True
+    """
+    n = job.size
+    if job.kind == 'csf':
+        return 0.5 + 2.5e-4 * factorial(n)
+    work = 2.5e-7 * factorial(n) * 2**(n-1) * (4 + job.boxes)
+    return 0.2 + work / job.units
+
+def estimate(job, timings):
+    r"""
+    Return the estimated time taken by `job` in seconds, from the dict
+    `timings` of the records of previous runs (see `record`).
+
+    This is the time recorded for the same job, if there is one.
+    Otherwise, it is its `prior_cost`, scaled by the ratio of recorded
+    times to prior costs for the jobs of the same kind and size, or
+    failing that of the same kind.
+
+    >>> job = hess_jobs((0, 0, 1))[0]
+    >>> timings = {'hess-000': {'kind': 'hess', 'size': 3,
+    ...                         'seconds': 2.0, 'prior': 1.0}}
+    >>> estimate(job, timings) == 2 * prior_cost(job)
+    True
+    >>> estimate(job, {}) == prior_cost(job)
+    True
+    """
+    if job.key in timings:
+        return timings[job.key]['seconds']
+    for same in ('kind', 'size'), ('kind',):
+        records = [
+            r for r in timings.itervalues()
+            if all(r[field] == getattr(job, field) for field in same)]
+        if records:
+            return prior_cost(job) * (
+                sum(r['seconds'] for r in records) /
+                sum(r['prior'] for r in records))
+    return prior_cost(job)
+
+def cached_file(cache, digest, filename):
+    r"""
+    Return the name of the copy of the output file `filename` in the
+    directory `cache`, for outputs computed by code with `digest`.
+
+    >>> cached_file('var/cache', '0123', 'output/hess-00.py')
+    'var/cache/0123/output/hess-00.py'
+    """
+    return os.path.join(cache, digest, filename)
+
+def is_cached(job, cache, digests):
+    r"""
+    Return whether all the outputs of `job` are in `cache`.
+    """
+    return all(
+        os.path.exists(cached_file(cache, digests[job.kind], filename))
+        for filename in job.outputs)
+
+def up_to_date(outputs, sources=SOURCES):
+    r"""
+    Return whether all the files in `outputs` exist and are newer than
+    all the files in `sources`, as Make would decide.
+    """
+    newest = max([0] + [os.path.getmtime(s) for s in sources])
+    try:
+        return all(os.path.getmtime(f) >= newest for f in outputs)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return False
+
+def is_done(job, cache, digests, sources=SOURCES):
+    r"""
+    Return whether the outputs of `job` are `up_to_date` or in `cache`.
+    """
+    return (up_to_date(job.outputs, sources) or
+            is_cached(job, cache, digests))
+
+def restore(job, cache, digests, sources=SOURCES):
+    r"""
+    Make sure that the outputs of a job which `is_done` are both in
+    place and in `cache`: copy them from `cache` unless they are
+    `up_to_date`, in which case they are copied to `cache` if they are
+    not there yet. Then touch the stamp of `job`, so that Make sees its
+    outputs as newer than the source files.
+    """
+    if not up_to_date(job.outputs, sources):
+        for filename in job.outputs:
+            _copy(cached_file(cache, digests[job.kind], filename), filename)
+    elif not is_cached(job, cache, digests):
+        keep(job, cache, digests)
+    _touch(job.stamp)
+
+def keep(job, cache, digests):
+    r"""
+    Copy the outputs of `job` to `cache`.
+    """
+    for filename in job.outputs:
+        _copy(filename, cached_file(cache, digests[job.kind], filename))
+
+def _touch(stamp):
+    if stamp is not None:
+        with open(stamp, 'a'):
+            os.utime(stamp, None)
+
+def _copy(source, target):
+    parent = os.path.dirname(target) or '.'
+    try:
+        os.makedirs(parent)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    fd, tmp = tempfile.mkstemp(dir=parent, prefix='.tmp-')
+    os.close(fd)
+    shutil.copyfile(source, tmp)
+    os.rename(tmp, target)
+
+def plan(sizes, timings, cache, digests, csf_flags=(), hess_flags=(),
+         split=None, partials='var/partial', sources=SOURCES):
+    r"""
+    Return the list of the jobs for the given `sizes` which are not
+    done (see `is_done`), sorted by decreasing `estimate`, the list of
+    those which are, and the dict mapping the names of the paths which
+    are split into work units to the job for the whole path. A path is
+    split if its estimated time is more than `split` seconds.
+    """
+    jobs, merges = [], {}
+    for n in sizes:
+        jobs.append(csf_job(n, csf_flags))
+        for path in iter_path(n):
+            whole = hess_jobs(path, hess_flags)
+            if (is_done(whole[0], cache, digests, sources) or
+                    split is None or estimate(whole[0], timings) <= split):
+                jobs.extend(whole)
+                continue
+            jobs.extend(hess_jobs(path, hess_flags, partials))
+            merges[''.join(map(str, path))] = whole[0]
+    done = [job for job in jobs if is_done(job, cache, digests, sources)]
+    jobs = [job for job in jobs
+            if not is_done(job, cache, digests, sources)]
+    jobs.sort(key=lambda job: -estimate(job, timings))
+    return jobs, done, merges
+
+# ---------------------------------------------------------
+
+def load_timings(filename):
+    r"""
+    Return the dict of timings recorded in `filename`, which is empty
+    if the file does not exist.
+    """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return {}
+
+def record(filename, timings, job, seconds):
+    r"""
+    Add the time taken by `job` to `timings`, and write them all to
+    `filename` under a temporary name which is then renamed.
+    """
+    timings[job.key] = {
+        'kind': job.kind, 'size': job.size,
+        'seconds': seconds, 'prior': prior_cost(job)}
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or '.', prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(timings, f, indent=0, sort_keys=True)
+    os.rename(tmp, filename)
+
+def run_job(job):
+    r"""
+    Run `job`, with its output in `var/log`, and return it with its
+    exit status and the time it took. Its outputs are not done (see
+    `plan`), so those which exist are out of date, and they are removed
+    first: `hess.py` would not redo partial results.
+    """
+    for filename in job.outputs:
+        if os.path.exists(filename):
+            os.remove(filename)
+    start = time.time()
+    with open(os.path.join('var', 'log', job.key + '.log'), 'w') as log:
+        status = subprocess.call(
+            job.command, stdout=log, stderr=subprocess.STDOUT)
+    if status == 0:
+        _touch(job.stamp)
+    return job, status, time.time() - start
+
+def run(jobs, done, merges, timings, timings_file, cache, digests,
+        workers=1, hess_flags=(), partials='var/partial'):
+    r"""
+    `restore` the outputs of the `done` jobs, run the `jobs` from `plan`
+    in order in `workers` processes, record their timings and keep their
+    outputs in `cache`, and merge the partial results of the paths in
+    `merges` as soon as all their work units are done. Log the progress
+    and the estimated time left after each job. Return the number of
+    jobs which failed.
+    """
+    for directory in 'output', os.path.join('var', 'log'):
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+    for job in done:
+        restore(job, cache, digests)
+    logger.info('%d jobs were already done, with their outputs in %s',
+                len(done), cache)
+    costs = {job.key: estimate(job, timings) for job in jobs}
+    total, done, failed = sum(costs.itervalues()), 0.0, 0
+    waiting = {name: 0 for name in merges}
+    for job in jobs:
+        name = job.key.split('-')[1]
+        if job.kind == 'hess' and name in waiting:
+            waiting[name] += 1
+    def merge(name):
+        with open(os.path.join('var', 'log', 'merge-%s.log' % name),
+                  'w') as log:
+            status = subprocess.call(
+                ['python', 'hess.py'] + list(hess_flags) + [
+                    '--partials', partials, '--merge', name],
+                stdout=log, stderr=subprocess.STDOUT)
+        if status:
+            logger.error('merging the partial results of %s failed', name)
+        else:
+            keep(merges[name], cache, digests)
+        return status != 0
+    for name in sorted(waiting):
+        if not waiting[name]:
+            failed += merge(name)
+    start = time.time()
+    logger.info('running %d jobs in %d processes, estimated at %s',
+                len(jobs), workers, _duration(total / workers))
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.imap_unordered(run_job, jobs, chunksize=1)
+        for count, (job, status, seconds) in enumerate(results, 1):
+            done += costs[job.key]
+            if status:
+                failed += 1
+                logger.error('job %s failed with status %d, see var/log',
+                             job.key, status)
+            else:
+                record(timings_file, timings, job, seconds)
+                keep(job, cache, digests)
+            name = job.key.split('-')[1]
+            if job.kind == 'hess' and name in waiting:
+                waiting[name] -= 1
+                if not waiting[name]:
+                    failed += merge(name)
+            elapsed = time.time() - start
+            logger.info(
+                'done %s in %.1fs (%d/%d jobs, %.1f jobs/min, '
+                '%.0f%% of the estimated work, %s left)',
+                job.key, seconds, count, len(jobs), 60 * count / elapsed,
+                100 * done / total if total else 100,
+                _duration(elapsed * (total - done) / done if done else 0))
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+def _duration(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+# ---------------------------------------------------------
+
+def doctest():
+    import doctest
+    doctest.testmod(verbose=False)
+
+def setup_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter(
+            '%(module)s (elapsed time %(relativeCreated)d): %(message)s'))
+    logger.addHandler(handler)
+
+# ---------------------------------------------------------
+
+def argparse():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Compute the outputs for the Dyck paths of the given '
+                    'sizes, running the longest jobs first.',
+        )
+    parser.add_argument(
+        'sizes',
+        nargs='*',
+        type=int,
+        metavar='n',
+        help='The sizes of Dyck paths to consider.',
+        )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='J',
+        help='The number of jobs to run at once (default: %(default)s).',
+        )
+    parser.add_argument(
+        '--csf-flags',
+        default='',
+        metavar='FLAGS',
+        help='Extra command line flags for csf.py.',
+        )
+    parser.add_argument(
+        '--hess-flags',
+        default='',
+        metavar='FLAGS',
+        help='Extra command line flags for hess.py.',
+        )
+    parser.add_argument(
+        '--split',
+        type=float,
+        metavar='SECONDS',
+        help='Split the Dyck paths expected to take more than SECONDS into '
+             'work units for each side and translator.',
+        )
+    parser.add_argument(
+        '--partials',
+        default='var/partial',
+        metavar='DIR',
+        help='Keep the partial results of split paths in DIR '
+             '(default: %(default)s).',
+        )
+    parser.add_argument(
+        '--cache',
+        default='var/cache',
+        metavar='DIR',
+        help='Keep the outputs in DIR, under a hash of the code which '
+             'computes them (default: %(default)s).',
+        )
+    parser.add_argument(
+        '--timings',
+        default='var/timings.json',
+        metavar='FILE',
+        help='Record the times taken by the jobs in FILE, and use them to '
+             'estimate the next ones (default: %(default)s).',
+        )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only print the jobs which would be run, with their estimated '
+             'times.',
+        )
+    parser.add_argument(
+        '--doctest',
+        action='store_true',
+        help='Run the doctests for this module first.',
+        )
+    return parser.parse_args()
+
+# ---------------------------------------------------------
+
+if __name__ == '__main__':
+    args = argparse()
+    if args.doctest:
+        doctest()
+    setup_logging()
+    timings = load_timings(args.timings)
+    csf_flags = shlex.split(args.csf_flags)
+    hess_flags = shlex.split(args.hess_flags)
+    hashes = digests()
+    jobs, done, merges = plan(
+        args.sizes, timings, args.cache, hashes, csf_flags, hess_flags,
+        args.split, args.partials)
+    if args.dry_run:
+        for job in jobs:
+            print '%10.1f  %s' % (
+                estimate(job, timings), ' '.join(job.command))
+        for name in sorted(merges):
+            print '%10s  merge %s' % ('', name)
+        print '%d jobs are already done' % len(done)
+    elif run(jobs, done, merges, timings, args.timings, args.cache,
+             hashes, args.jobs, hess_flags, args.partials):
+        raise SystemExit(1)
+
+# ---------------------------------------------------------
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+r"""
+Code for storing intermediate results on disk.
+
+A stored entry is a directory of `.npy` files, one per named array,
+which can be memory-mapped when it is loaded. Entries are written to a
+temporary directory which is then renamed into place, so that several
+processes (e.g. from `make -j`) can share a store: readers only ever
+see complete entries, and when two writers race the first one wins.
+
+Entries are usually grouped under a version hash of the source code of
+the functions which computed them (see `code_hash`), so that editing
+those functions never reuses stale results.
+
+To run some tests for this module, use the command:
+$ python store.py
+For more verbose output, use:
+$ python store.py -v
+
+"""
+
+__all__ = [
+    'build_arrays',
+    'code_closure',
+    'code_hash',
+    'load_arrays',
+    'new_array',
+    'result_hash',
+    'save_arrays',
+    ]
+
+# ---------------------------------------------------------
+
+import ast
+import errno
+import hashlib
+import inspect
+import os
+import shutil
+import tempfile
+import textwrap
+import numpy as np
+
+# ---------------------------------------------------------
+
+def code_hash(*functions):
+    r"""
+    Return a short hash of the code of the given functions. Memoised
+    functions are looked through (see `memo.Memo`). Docstrings, comments
+    and layout are left out, so that editing them (e.g. the doctests)
+    does not change the hash.
+
+    >>> code_hash(code_hash) == code_hash(code_hash)
+    True
+    >>> code_hash(code_hash) == code_hash(load_arrays)
+    False
+    >>> def f(x):
+    ...     "Double x."
+    ...     return 2*x
+    >>> before = code_hash(f)
+    >>> def f(x):
+    ...     # a comment
+    ...     return 2 * x
+    >>> code_hash(f) == before
+    True
+    """
+    digest = hashlib.sha1()
+    for function in functions:
+        function = getattr(function, 'function', function)
+        tree = ast.parse(textwrap.dedent(inspect.getsource(function)))
+        for node in ast.walk(tree):
+            body = getattr(node, 'body', None)
+            if (isinstance(node, (ast.FunctionDef, ast.ClassDef)) and
+                    isinstance(body[0], ast.Expr) and
+                    isinstance(body[0].value, ast.Str)):
+                node.body = body[1:]
+        digest.update(ast.dump(tree))
+    return digest.hexdigest()[:16]
+
+def code_closure(*functions):
+    r"""
+    Return the list of the functions of this package which the given
+    functions may call, including themselves, sorted by module and name,
+    and the list of the names and values of the simple constants of this
+    package which they read (numbers, strings, tuples and arrays).
+
+    These are found by following the global names used by the code of
+    each function, including its nested functions and generators, and
+    going into the lists, tuples and dicts they refer to, and into the
+    variables and default arguments of closures. This may find
+    more than is needed, but never less, as long as functions are only
+    reached through global names.
+
+    >>> functions, constants = code_closure(save_arrays)
+    >>> [f.__name__ for f in functions]
+    ['build_arrays', 'save_arrays']
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    simple = (int, long, float, str, tuple, np.ndarray)
+    found, constants = {}, {}
+    todo = list(functions)
+    while todo:
+        value = todo.pop()
+        value = getattr(value, 'function', value)
+        if isinstance(value, (list, tuple)) and not isinstance(value, str):
+            todo.extend(value)
+            continue
+        if isinstance(value, dict):
+            todo.extend(value.itervalues())
+            continue
+        if not inspect.isfunction(value) or value in found.values():
+            continue
+        filename = inspect.getsourcefile(value)
+        if not filename or os.path.dirname(os.path.abspath(filename)) != here:
+            continue
+        found[value.__module__, value.__name__] = value
+        todo.extend(cell.cell_contents for cell in value.__closure__ or ())
+        todo.extend(value.__defaults__ or ())
+        codes = [value.__code__]
+        while codes:
+            code = codes.pop()
+            codes.extend(c for c in code.co_consts if inspect.iscode(c))
+            for name in code.co_names:
+                if name not in value.__globals__:
+                    continue
+                item = value.__globals__[name]
+                if isinstance(item, simple):
+                    constants[value.__module__, name] = item
+                else:
+                    todo.append(item)
+    return ([found[key] for key in sorted(found)],
+            [(key, constants[key]) for key in sorted(constants)])
+
+def result_hash(*functions):
+    r"""
+    Return a short hash of the code of the functions in the
+    `code_closure` of the given functions and of the constants they
+    read, for keying results which only depend on what these functions
+    compute.
+
+    >>> result_hash(save_arrays) == result_hash(build_arrays, save_arrays)
+    True
+    >>> result_hash(save_arrays) == result_hash(load_arrays)
+    False
+    """
+    functions, constants = code_closure(*functions)
+    digest = hashlib.sha1(code_hash(*functions))
+    for (module, name), value in constants:
+        if isinstance(value, np.ndarray):
+            value = (value.dtype.str, value.shape, value.tobytes())
+        digest.update(repr((module, name, value)))
+    return digest.hexdigest()[:16]
+
+def save_arrays(directory, arrays):
+    r"""
+    Atomically store the dict `arrays` of named arrays as the entry
+    `directory`. Return False if the entry already exists.
+
+    >>> root = tempfile.mkdtemp()
+    >>> entry = os.path.join(root, 'a', 'b')
+    >>> save_arrays(entry, {'x': np.arange(3)})
+    True
+    >>> save_arrays(entry, {'x': np.arange(4)})
+    False
+    >>> load_arrays(entry)['x']
+    memmap([0, 1, 2])
+    >>> load_arrays(os.path.join(root, 'c')) is None
+    True
+    >>> shutil.rmtree(root)
+    """
+    def fill(tmp):
+        for name, array in arrays.iteritems():
+            np.save(os.path.join(tmp, name + '.npy'), array)
+    return build_arrays(directory, fill)
+
+def build_arrays(directory, fill):
+    r"""
+    Atomically store the entry `directory`, whose arrays are written by
+    calling `fill` on a temporary directory, e.g. with `new_array`.
+    Return False if the entry already exists.
+
+    This allows entries larger than memory to be written piece by piece.
+
+    >>> root = tempfile.mkdtemp()
+    >>> entry = os.path.join(root, 'a')
+    >>> def fill(tmp):
+    ...     x = new_array(tmp, 'x', (4,), np.int64)
+    ...     x[:2], x[2:] = 1, 2
+    >>> build_arrays(entry, fill)
+    True
+    >>> load_arrays(entry)['x']
+    memmap([1, 1, 2, 2])
+    >>> shutil.rmtree(root)
+    """
+    if os.path.isdir(directory):
+        return False
+    parent = os.path.dirname(directory)
+    try:
+        os.makedirs(parent)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        fill(tmp)
+        try:
+            os.rename(tmp, directory)
+        except OSError as error:
+            if error.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            return False
+        return True
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+
+def new_array(directory, name, shape, dtype):
+    r"""
+    Create the array `name` of the given `shape` and `dtype` in
+    `directory`, filled with zeros, and return it memory-mapped for
+    writing.
+    """
+    return np.lib.format.open_memmap(
+        os.path.join(directory, name + '.npy'), mode='w+',
+        dtype=dtype, shape=shape)
+
+def load_arrays(directory, mmap_mode='r'):
+    r"""
+    Load the entry `directory` as a dict of named arrays, which are
+    memory-mapped according to `mmap_mode`. Return None if the entry
+    does not exist.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return None
+    return {
+        name[:-len('.npy')]:
+            np.load(os.path.join(directory, name), mmap_mode=mmap_mode)
+        for name in names
+        if name.endswith('.npy')
+        }
+
+# ---------------------------------------------------------
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+# ---------------------------------------------------------